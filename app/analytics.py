@@ -0,0 +1,140 @@
+"""Exam performance analytics for a batch or a year.
+
+ExamHistory rows are read once, ordered by student and date, into NumPy
+columns; every figure is then computed over whole arrays (grouped sums with
+np.add.reduceat/np.bincount, cumulative sums for moving averages and
+searchsorted for ranks), so the cost per student is a few array elements rather
+than a Python loop and a query.
+
+For each student: overall percentage (sum of obtained over sum of total marks,
+as in the monthly percentage endpoints), rank and percentile rank within the
+group, the average percentage of their last `window` exams and the improvement
+of that average over their first `window` exams. For each subject: overall
+percentage and how many exams and students it covers.
+"""
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import models, schemas
+from .periods import in_period
+
+def scoped(query, kb_batch=None, year=None):
+    """Restrict an ExamHistory query (or select) to a kb_batch and/or a year."""
+    query = query.filter(models.ExamHistory.student_id.isnot(None))
+    if kb_batch is not None:
+        query = query.join(models.Student).filter(models.Student.kb_batch == kb_batch)
+    if year is not None:
+        query = query.filter(in_period(models.ExamHistory.date, year))
+    return query
+
+def load_exams(db: Session, kb_batch=None, year=None):
+    """Return (student_ids, subjects, total_marks, obtained_marks) columns ordered by student and date."""
+    # A Core select skips the ORM's per-row entity handling, which dominates at this size
+    query = scoped(select(
+        models.ExamHistory.student_id,
+        models.ExamHistory.subject_name,
+        models.ExamHistory.total_marks,
+        models.ExamHistory.obtained_marks
+    ), kb_batch, year)
+    rows = db.execute(
+        query.order_by(models.ExamHistory.student_id, models.ExamHistory.date, models.ExamHistory.id)
+    ).all()
+    if not rows:
+        return None
+    student_ids, subjects, total_marks, obtained_marks = zip(*rows)
+    return (
+        np.array(student_ids, dtype=object),
+        subjects,
+        np.array(total_marks, dtype=np.float64),
+        np.array(obtained_marks, dtype=np.float64),
+    )
+
+def percentages(obtained, total):
+    return np.divide(obtained * 100, total, out=np.zeros_like(obtained), where=total > 0)
+
+def student_stats(student_ids, total_marks, obtained_marks, window):
+    """Per-student arrays; rows must be grouped by student and in date order within each group."""
+    starts = np.flatnonzero(np.r_[True, student_ids[1:] != student_ids[:-1]])
+    ends = np.r_[starts[1:], len(student_ids)]
+    counts = ends - starts
+
+    overall = percentages(np.add.reduceat(obtained_marks, starts), np.add.reduceat(total_marks, starts))
+
+    # Windowed means from one cumulative sum over every exam's percentage
+    cumulative = np.r_[0.0, np.cumsum(percentages(obtained_marks, total_marks))]
+    span = np.minimum(counts, window)
+    recent = (cumulative[ends] - cumulative[ends - span]) / span
+    first = (cumulative[starts + span] - cumulative[starts]) / span
+
+    # Rank 1 is the best; percentile rank counts ties as half below
+    ordered = np.sort(overall)
+    below = np.searchsorted(ordered, overall, side="left")
+    not_above = np.searchsorted(ordered, overall, side="right")
+    rank = len(overall) - not_above + 1
+    percentile = (below + not_above) / 2 / len(overall) * 100
+
+    return starts, counts, overall, rank, percentile, recent, recent - first
+
+def subject_stats(student_group, subjects, total_marks, obtained_marks):
+    codes = {}
+    subject_codes = np.fromiter((codes.setdefault(subject, len(codes)) for subject in subjects), dtype=np.int64, count=len(subjects))
+    n = len(codes)
+    exams = np.bincount(subject_codes, minlength=n)
+    overall = percentages(
+        np.bincount(subject_codes, weights=obtained_marks, minlength=n),
+        np.bincount(subject_codes, weights=total_marks, minlength=n)
+    )
+    # Distinct (student, subject) pairs, counted per subject
+    pairs = np.unique(student_group * n + subject_codes)
+    students = np.bincount(pairs % n, minlength=n)
+    return list(codes), exams, students, overall
+
+def exam_analytics(db: Session, window: int, kb_batch=None, year=None):
+    columns = load_exams(db, kb_batch=kb_batch, year=year)
+    if columns is None:
+        raise HTTPException(status_code=404, detail="No exams found")
+    student_ids, subjects, total_marks, obtained_marks = columns
+
+    starts, counts, overall, rank, percentile, recent, improvement = student_stats(
+        student_ids, total_marks, obtained_marks, window
+    )
+    ids = student_ids[starts].tolist()
+    details = {
+        student_id: (name, batch) for student_id, name, batch in db.query(
+            models.Student.id, models.Student.name, models.Student.kb_batch
+        ).filter(models.Student.id.in_(scoped(db.query(models.ExamHistory.student_id), kb_batch, year)))
+    }
+
+    student_group = np.repeat(np.arange(len(starts)), counts)
+    names, subject_exams, subject_students, subject_overall = subject_stats(
+        student_group, subjects, total_marks, obtained_marks
+    )
+
+    # Students are already in id order, so a stable sort breaks rank ties by id
+    order = np.argsort(rank, kind="stable")
+    students = [
+        schemas.StudentExamRanking(
+            student_id=ids[i],
+            name=details.get(ids[i], (None, None))[0],
+            kb_batch=details.get(ids[i], (None, None))[1],
+            exams=int(counts[i]),
+            percentage=round(float(overall[i]), 2),
+            rank=int(rank[i]),
+            percentile=round(float(percentile[i]), 2),
+            moving_average=round(float(recent[i]), 2),
+            improvement=round(float(improvement[i]), 2)
+        )
+        for i in order.tolist()
+    ]
+    subject_order = np.argsort(-subject_overall, kind="stable")
+    subject_rows = [
+        schemas.SubjectPerformance(
+            subject_name=names[i],
+            exams=int(subject_exams[i]),
+            students=int(subject_students[i]),
+            percentage=round(float(subject_overall[i]), 2)
+        )
+        for i in subject_order.tolist()
+    ]
+    return schemas.ExamAnalytics(kb_batch=kb_batch, year=year, window=window, students=students, subjects=subject_rows)
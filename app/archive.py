@@ -0,0 +1,276 @@
+"""Cold storage for the attendance, payments and exams of closed years.
+
+`python -m app.archive archive YEAR` moves every attendance mark, payment and
+exam dated in YEAR out of the live tables into KB_ARCHIVE_DIR/YEAR.sqlite, a
+compacted, read-only SQLite file with the same tables, indexes and row ids. The
+live tables, their indexes and the nightly backups shrink accordingly, while the
+rows stay one query away:
+
+  - the yearly payment and exam lists (including `?stream=1`) read the year's
+    archive when there is one
+  - per-student payment and exam histories and their Excel exports read every
+    archive after the live rows
+  - dues_ledger and attendance_monthly keep their rows for archived years, so
+    dues, yearly dues and attendance summaries are unchanged
+
+Monthly lists, percentages, due payment lists, analytics and reports read the
+live tables only. Records dated in an archived year can't be created, changed
+or deleted (409) until the year is restored with
+`python -m app.archive restore YEAR`, which moves the rows back and removes the
+file. Both commands verify the row counts on each side before committing.
+Resetting the database deletes the archive files as well.
+
+Archiving holds the database's write lock while it copies the year, so run it
+when the center is closed; API writes wait for it up to the busy timeout.
+"""
+import os
+import re
+import sys
+from contextlib import ExitStack
+from datetime import date
+from heapq import merge
+from urllib.parse import quote
+from fastapi import HTTPException
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from . import models, database, etags, metrics
+from .periods import in_period
+
+ARCHIVE_DIR = os.getenv("KB_ARCHIVE_DIR", "archive")
+MODELS = (models.Attendance, models.PaymentHistory, models.ExamHistory)
+COPY_BATCH = 5000
+
+class ArchiveError(Exception):
+    pass
+
+def archive_path(year: int):
+    return os.path.join(ARCHIVE_DIR, f"{year}.sqlite")
+
+def archived_years():
+    """Years with an archive file, oldest first."""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in map(re.compile(r"^(\d{4})\.sqlite$").match, names) if match)
+
+def ensure_writable(*days: date):
+    """Raise a 409 if any of `days` falls in an archived year."""
+    closed = set(archived_years()).intersection(day.year for day in days)
+    if closed:
+        raise HTTPException(status_code=409, detail=f"{min(closed)} is archived; restore it to change its records")
+
+# Reading
+
+_readers = {}
+
+def reader(year: int):
+    """A read-only engine on the year's archive file."""
+    path = os.path.abspath(archive_path(year))
+    engine = _readers.get(path)
+    if engine is None:
+        # The file never changes once in place (restore removes it), so SQLite can
+        # skip locking. NullPool opens whatever file is at the path on each use.
+        engine = create_engine(f"sqlite:///file:{quote(path)}?mode=ro&immutable=1&uri=true", poolclass=NullPool)
+        metrics.instrument(engine)
+        engine = _readers.setdefault(path, engine)
+    return engine
+
+def sources(db: Session, years=None):
+    """Yield `db`, then a session on the archive of each of `years` that is
+    archived (default: every archived year), closing each when the next is due."""
+    yield db
+    archived = archived_years()
+    for year in archived if years is None else [year for year in years if year in archived]:
+        with Session(reader(year)) as session:
+            yield session
+
+def all_rows(db: Session, build_query, years=None):
+    """build_query(session).all() for the live database and the archives, concatenated."""
+    rows = []
+    for session in sources(db, years):
+        rows.extend(build_query(session).all())
+    return rows
+
+def iter_rows(db: Session, build_query, years=None, batch=1000):
+    """Stream build_query(session) from the live database, then from the archives."""
+    for session in sources(db, years):
+        yield from build_query(session).yield_per(batch)
+
+def merged_rows(db: Session, build_query, key, years=None, batch=1000):
+    """Stream build_query(session) from the live database and the archives merged
+    in `key` order; each query must already be ordered by it."""
+    archived = archived_years()
+    with ExitStack() as stack:
+        streams = [build_query(db).yield_per(batch)]
+        for year in archived if years is None else [year for year in years if year in archived]:
+            session = stack.enter_context(Session(reader(year)))
+            streams.append(build_query(session).yield_per(batch))
+        yield from merge(*streams, key=key)
+
+def remove_archives():
+    """Delete every archive file; resetting the database does, so archived rows
+    can't resurface under the student ids a reset hands out again."""
+    for year in archived_years():
+        os.remove(archive_path(year))
+    for engine in _readers.values():
+        engine.dispose()
+    _readers.clear()
+
+# Archiving and restoring
+
+def row_counts(conn, year: int):
+    return {
+        model.__tablename__: conn.execute(
+            select(func.count()).select_from(model.__table__).where(in_period(model.__table__.c.date, year))
+        ).scalar()
+        for model in MODELS
+    }
+
+def year_student_ids(db: Session, year: int):
+    ids = set()
+    for model in MODELS:
+        ids.update(student_id for (student_id,) in db.query(model.student_id).filter(in_period(model.date, year)).distinct())
+    ids.discard(None)
+    return ids
+
+def archive_year(db: Session, year: int):
+    """Move `year`'s rows into its archive file and return the number of rows per table."""
+    if year >= date.today().year:
+        raise ArchiveError(f"{year} isn't over yet; only past years can be archived")
+    path = archive_path(year)
+    if os.path.exists(path):
+        raise ArchiveError(f"{year} is already archived in {path}")
+    expected = row_counts(db.connection(), year)
+    if not any(expected.values()):
+        raise ArchiveError(f"Nothing is recorded in {year}")
+
+    # Bumping the students' versions first takes the write lock, so the year
+    # can't change between the copy and the delete
+    etags.touch(db, *year_student_ids(db, year))
+    expected = row_counts(db.connection(), year)
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    temporary = path + ".tmp"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    try:
+        target = create_engine(f"sqlite:///{temporary}", poolclass=NullPool)
+        try:
+            tables = [model.__table__ for model in MODELS]
+            models.Base.metadata.create_all(target, tables=tables)
+            with target.begin() as conn:
+                for table in tables:
+                    result = db.connection().execute(
+                        select(table).where(in_period(table.c.date, year)).execution_options(yield_per=COPY_BATCH)
+                    )
+                    for rows in result.mappings().partitions():
+                        conn.execute(table.insert(), [dict(row) for row in rows])
+            with target.connect() as conn:
+                copied = row_counts(conn, year)
+                if copied != expected:
+                    raise ArchiveError(f"Copied {copied} rows to the archive but {expected} are recorded")
+                conn.exec_driver_sql("VACUUM")
+        finally:
+            target.dispose()
+
+        for model in MODELS:
+            deleted = db.query(model).filter(in_period(model.date, year)).delete(synchronize_session=False)
+            if deleted != expected[model.__tablename__]:
+                raise ArchiveError(f"Deleted {deleted} {model.__tablename__} rows but archived {expected[model.__tablename__]}")
+        os.chmod(temporary, 0o444)
+        os.replace(temporary, path)
+    except BaseException:
+        db.rollback()
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    try:
+        db.commit()
+    except BaseException:
+        # The rows are still live; don't serve them twice
+        os.remove(path)
+        raise
+    return expected
+
+def restore_year(db: Session, year: int):
+    """Move `year`'s archived rows back into the live tables, remove the archive
+    file and return the number of rows per table."""
+    path = archive_path(year)
+    if not os.path.exists(path):
+        raise ArchiveError(f"{year} isn't archived")
+    source = reader(year)
+    with source.connect() as conn:
+        expected = row_counts(conn, year)
+        live = row_counts(db.connection(), year)
+        for model in MODELS:
+            table = model.__table__
+            ids = [row_id for (row_id,) in conn.execute(select(table.c.id))]
+            for start in range(0, len(ids), COPY_BATCH):
+                clash = db.execute(select(table.c.id).where(table.c.id.in_(ids[start:start + COPY_BATCH])).limit(1)).first()
+                if clash is not None:
+                    raise ArchiveError(f"{table.name} row {clash[0]} exists both live and in {path}")
+
+        archived_students = set()
+        for model in MODELS:
+            table = model.__table__
+            archived_students.update(
+                student_id for (student_id,) in conn.execute(select(table.c.student_id).distinct()) if student_id is not None
+            )
+        # Rows of students deleted since are detached, as deleting them would have done
+        existing = {student_id for (student_id,) in db.query(models.Student.id).filter(models.Student.id.in_(archived_students))}
+
+        try:
+            for model in MODELS:
+                result = conn.execute(select(model.__table__).execution_options(yield_per=COPY_BATCH))
+                for rows in result.mappings().partitions():
+                    rows = [dict(row) for row in rows]
+                    for row in rows:
+                        if row["student_id"] not in existing:
+                            row["student_id"] = None
+                    database.bulk_insert(db, model, rows)
+            restored = row_counts(db.connection(), year)
+            wanted = {name: live[name] + count for name, count in expected.items()}
+            if restored != wanted:
+                raise ArchiveError(f"Restored tables hold {restored} rows for {year}, expected {wanted}")
+            etags.touch(db, *existing)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    # Once committed the rows are live; until the file is gone they are listed twice
+    os.remove(path)
+    engine = _readers.pop(os.path.abspath(path), None)
+    if engine is not None:
+        engine.dispose()
+    return expected
+
+def main(argv):
+    if not (argv == ["list"] or (len(argv) == 2 and argv[0] in ("archive", "restore") and argv[1].isdigit())):
+        print("usage: python -m app.archive archive|restore YEAR | list", file=sys.stderr)
+        return 2
+    if argv[0] == "list":
+        for year in archived_years():
+            with reader(year).connect() as conn:
+                counts = row_counts(conn, year)
+            size = os.path.getsize(archive_path(year)) / 2**20
+            print(f"{year}  {size:8.1f} MiB  " + "  ".join(f"{name} {count}" for name, count in counts.items()))
+        return 0
+
+    database.migrate()
+    db = database.SessionLocal()
+    try:
+        action = archive_year if argv[0] == "archive" else restore_year
+        counts = action(db, int(argv[1]))
+    except ArchiveError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    verb = "Archived" if argv[0] == "archive" else "Restored"
+    print(f"{verb} {argv[1]}: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,159 @@
+"""Database backends.
+
+The backend is chosen from the dialect of the configured database URL and
+owns everything that differs between databases: engine options, per-connection
+setup, the async driver, upsert support, resetting and bulk loading.
+"""
+import csv
+import io
+import os
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import postgresql, sqlite
+
+POOL_SIZE = int(os.getenv("KB_DB_POOL_SIZE", "10"))
+POOL_MAX_OVERFLOW = int(os.getenv("KB_DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = int(os.getenv("KB_DB_POOL_TIMEOUT", "30"))
+
+class Backend:
+    name = None
+    async_driver = None
+
+    def __init__(self, url):
+        self.url = make_url(url)
+
+    def engine_options(self):
+        return {"pool_size": POOL_SIZE, "max_overflow": POOL_MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT}
+
+    def async_url(self):
+        return self.url.set(drivername=f"{self.name}+{self.async_driver}")
+
+    def on_connect(self, dbapi_connection, connection_record):
+        pass
+
+    def insert(self, table):
+        """An INSERT construct supporting on_conflict_do_update()."""
+        raise NotImplementedError
+
+    def schema_version(self, conn):
+        """The version stamped by set_schema_version(), or None if there is none."""
+        if not inspect(conn).has_table("kb_schema_version"):
+            return None
+        return conn.execute(text("SELECT MAX(version) FROM kb_schema_version")).scalar()
+
+    def set_schema_version(self, conn, version):
+        conn.execute(text("CREATE TABLE IF NOT EXISTS kb_schema_version (version BIGINT NOT NULL)"))
+        conn.execute(text("DELETE FROM kb_schema_version"))
+        conn.execute(text("INSERT INTO kb_schema_version (version) VALUES (:version)"), {"version": version})
+
+    def reset(self, engine, metadata):
+        """Remove every row from the application's tables."""
+        with engine.begin() as conn:
+            metadata.drop_all(bind=conn)
+        metadata.create_all(bind=engine)
+
+    def bulk_insert(self, conn, table, rows):
+        """Insert a list of column dicts using the fastest path the database offers.
+
+        The default is a single executemany() of one prepared INSERT, which is
+        the fastest way to load SQLite inside a transaction.
+        """
+        if rows:
+            conn.execute(table.insert(), rows)
+
+class SQLiteBackend(Backend):
+    name = "sqlite"
+    async_driver = "aiosqlite"
+
+    # Pragmas applied to every new connection. WAL lets readers carry on while a
+    # writer commits, and synchronous=NORMAL is safe under WAL while skipping an
+    # fsync per commit. Each can be overridden with KB_SQLITE_<NAME>, or the whole
+    # profile skipped with KB_SQLITE_PROFILE=default.
+    PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": "-65536",      # negative is KiB: 64 MiB page cache
+        "mmap_size": "268435456",    # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": "5000",      # ms to wait on a locked database before SQLITE_BUSY
+    }
+
+    @property
+    def in_memory(self):
+        return self.url.database in (None, "", ":memory:")
+
+    def engine_options(self):
+        options = {"connect_args": {"check_same_thread": False}}
+        # In-memory databases use a single shared connection, not a queue
+        if not self.in_memory:
+            options.update(super().engine_options())
+        return options
+
+    def pragmas(self):
+        if os.getenv("KB_SQLITE_PROFILE", "performance") == "default":
+            return {}
+        return {name: os.getenv(f"KB_SQLITE_{name.upper()}", value) for name, value in self.PRAGMAS.items()}
+
+    def on_connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas().items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    def insert(self, table):
+        return sqlite.insert(table)
+
+    # The database header has a free integer for this, so no extra table is needed
+    def schema_version(self, conn):
+        return conn.exec_driver_sql("PRAGMA user_version").scalar() or None
+
+    def set_schema_version(self, conn, version):
+        conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+class PostgresBackend(Backend):
+    name = "postgresql"
+    async_driver = "asyncpg"
+
+    def insert(self, table):
+        return postgresql.insert(table)
+
+    def reset(self, engine, metadata):
+        tables = ", ".join(table.name for table in metadata.sorted_tables)
+        metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+
+    def bulk_insert(self, conn, table, rows):
+        # COPY ... FROM STDIN streams the rows in one round-trip, skipping
+        # per-statement parsing and planning.
+        if not rows:
+            return
+        columns = list(rows[0])
+        copy_sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in rows:
+                    writer.writerow([_csv_value(row[column]) for column in columns])
+                buffer.seek(0)
+                cursor.copy_expert(f"{copy_sql} WITH (FORMAT csv)", buffer)
+            else:  # psycopg 3 adapts Python values itself
+                with cursor.copy(copy_sql) as copy:
+                    for row in rows:
+                        copy.write_row([row[column] for column in columns])
+        finally:
+            cursor.close()
+
+def _csv_value(value):
+    # COPY's csv format reads an unquoted empty field as NULL
+    return "" if value is None else value
+
+BACKENDS = {backend.name: backend for backend in (SQLiteBackend, PostgresBackend)}
+
+def get_backend(url):
+    dialect = make_url(url).get_backend_name()
+    if dialect not in BACKENDS:
+        raise ValueError(f"Unsupported database backend: {dialect}")
+    return BACKENDS[dialect](url)
@@ -0,0 +1,187 @@
+"""Response cache for per-student read endpoints.
+
+crud functions decorated with @cached(name) store their result under
+(name, student_id, *args) and tag it with the student_id; every write that
+touches a student calls invalidate(student_id) after committing, which drops
+all of that student's entries.
+
+The store is pluggable: it is chosen with KB_CACHE_BACKEND ("memory", the
+default, or "none") and anything implementing the Cache interface can be
+added to CACHES, e.g. a shared cache used by several worker processes. The
+in-process MemoryCache is per worker, so a write handled by one worker is seen
+by the others only once their entries expire (KB_CACHE_TTL seconds).
+"""
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.getenv("KB_CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.getenv("KB_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL = float(os.getenv("KB_CACHE_TTL", "30"))
+
+class Cache:
+    name = None
+
+    def get(self, key):
+        """Return (True, value) for a live entry, else (False, None)."""
+        raise NotImplementedError
+
+    def token(self, tag):
+        """An opaque value that changes whenever `tag` is invalidated.
+
+        Taken before loading a value and passed to set(), so a value loaded
+        while a write to the same student committed is not stored.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, tag, token):
+        raise NotImplementedError
+
+    def invalidate(self, tag):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+class NullCache(Cache):
+    name = "none"
+
+    def get(self, key):
+        return False, None
+
+    def token(self, tag):
+        return None
+
+    def set(self, key, value, tag, token):
+        pass
+
+    def invalidate(self, tag):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name}
+
+class MemoryCache(Cache):
+    """A bounded LRU of (expiry, value) entries with a per-tag key index."""
+    name = "memory"
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()   # key -> (expires_at, tag, value)
+        self.tags = {}                 # tag -> set of keys
+        self.generations = {}          # tag -> invalidation count
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(("hits", "misses", "evictions", "expirations", "invalidations"), 0)
+
+    def _remove(self, key):
+        _, tag, _ = self.entries.pop(key)
+        keys = self.tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.tags[tag]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.counts["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counts["misses"] += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return True, entry[2]
+
+    def token(self, tag):
+        with self.lock:
+            return self.generations.get(tag, 0)
+
+    def set(self, key, value, tag, token):
+        with self.lock:
+            if self.generations.get(tag, 0) != token:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, tag, value)
+            self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.counts["evictions"] += 1
+
+    def invalidate(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            for key in self.tags.pop(tag, ()):
+                del self.entries[key]
+                self.counts["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            # Bump every known tag so loads already in flight aren't stored
+            for tag in self.generations:
+                self.generations[tag] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return {
+                "backend": self.name,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                **self.counts,
+                "hit_ratio": round(self.counts["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+CACHES = {cache.name: cache for cache in (MemoryCache, NullCache)}
+
+def get_cache(name=CACHE_BACKEND):
+    if name not in CACHES:
+        raise ValueError(f"Unsupported cache backend: {name}")
+    return CACHES[name]()
+
+cache = get_cache()
+
+def cached(name):
+    """Cache a crud function whose arguments are (db, student_id, *hashable_args).
+
+    Callers may pass `version`, e.g. the ETag they are about to send, to keep
+    entries for different versions of the student's data apart.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(db, student_id, *args, version=None):
+            key = (name, student_id, *args, version)
+            hit, value = cache.get(key)
+            if hit:
+                return value
+            token = cache.token(student_id)
+            value = fn(db, student_id, *args)
+            cache.set(key, value, student_id, token)
+            return value
+        return wrapper
+    return decorate
+
+def invalidate(*student_ids):
+    for student_id in student_ids:
+        cache.invalidate(student_id)
+
+def clear():
+    cache.clear()
+
+def stats():
+    return cache.stats()
@@ -0,0 +1,701 @@
+"""Database operations behind the API routes.
+
+Each function takes a synchronous Session as its first argument and returns
+fully built schema objects, so it can run either in the threadpool or inside
+AsyncSession.run_sync() without anything being lazy-loaded afterwards.
+"""
+from fastapi import HTTPException
+from sqlalchemy.orm import Session, selectinload, noload
+from sqlalchemy import func, and_
+from . import models, schemas, database, student_ids, ledger, rollups, etags, archive
+from .fastjson import row_dicts
+from .cache import cached, invalidate
+from .periods import in_period, period_bounds
+from typing import Optional
+from datetime import date
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Student relationships that can be requested with ?include=
+STUDENT_INCLUDES = {
+    "payments": ("payment_history", models.Student.payment_history, schemas.PaymentHistory),
+    "exams": ("exam_history", models.Student.exam_history, schemas.ExamHistory),
+}
+
+def student_load_options(include):
+    # selectinload fetches a history for any number of students in one extra query;
+    # noload keeps histories that weren't asked for from being lazy-loaded at all.
+    return [
+        selectinload(relationship) if name in include else noload(relationship)
+        for name, (_, relationship, _) in STUDENT_INCLUDES.items()
+    ]
+
+def student_response(student, include):
+    response = schemas.Student(**schemas.StudentSummary.from_orm(student).dict())
+    for name, (field, _, schema) in STUDENT_INCLUDES.items():
+        if name in include:
+            setattr(response, field, [schema.from_orm(row) for row in getattr(student, field)])
+    return response
+
+# Aggregate columns shared by the per-student and per-batch monthly summaries.
+# COALESCE keeps SUM() at 0 for students with no rows in the period.
+def payment_totals():
+    return (
+        func.coalesce(func.sum(models.PaymentHistory.payment), 0),
+        func.coalesce(func.sum(models.PaymentHistory.paid), 0),
+        func.coalesce(func.sum(models.PaymentHistory.due), 0)
+    )
+
+def exam_totals():
+    return (
+        func.sum(models.ExamHistory.total_marks),
+        func.sum(models.ExamHistory.obtained_marks)
+    )
+
+def exam_percentage(total_marks, obtained_marks):
+    percentage = (obtained_marks / total_marks) * 100 if total_marks > 0 else 0
+    return round(percentage, 2)
+
+def create_student(db: Session, student: schemas.StudentCreate, include: set):
+    unique_id = student_ids.next_id(db, student.hsc_batch)
+    db_student = models.Student(id=unique_id, **student.dict())
+    db.add(db_student)
+    db.commit()
+    db.refresh(db_student)
+    return student_response(db_student, include)
+
+def get_students(db: Session, cursor: Optional[str], limit: int, hsc_batch: Optional[str], kb_batch: Optional[str], name: Optional[str]):
+    # Keyset pagination: each page starts after the last id of the previous one,
+    # so deep pages cost the same as the first instead of skipping OFFSET rows.
+    query = db.query(
+        models.Student.id,
+        models.Student.name,
+        models.Student.hsc_batch,
+        models.Student.kb_batch,
+        models.Student.phone,
+        models.Student.address
+    )
+    if cursor is not None:
+        query = query.filter(models.Student.id > cursor)
+    if hsc_batch is not None:
+        query = query.filter(models.Student.hsc_batch == hsc_batch)
+    if kb_batch is not None:
+        query = query.filter(models.Student.kb_batch == kb_batch)
+    if name:
+        escaped = name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(models.Student.name.like(f"{escaped}%", escape="\\"))
+
+    # Fetch one extra row to learn whether there is a next page
+    rows = query.order_by(models.Student.id).limit(limit + 1).all()
+    students = [schemas.StudentSummary.from_orm(row) for row in rows[:limit]]
+    next_cursor = students[-1].id if len(rows) > limit else None
+    return schemas.StudentPage(students=students, next_cursor=next_cursor)
+
+def get_student(db: Session, student_id: str, include: set):
+    student = db.query(models.Student).options(*student_load_options(include)).filter(models.Student.id == student_id).first()
+    if student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return student_response(student, include)
+
+def get_students_by_batch(db: Session, kb_batch: str, include: set):
+    students = db.query(models.Student).options(*student_load_options(include)).filter(models.Student.kb_batch == kb_batch).all()
+    if not students:
+        raise HTTPException(status_code=404, detail="No students found for this batch")
+    return [student_response(student, include) for student in students]
+
+def add_attendance(db: Session, attendance: schemas.AttendanceCreate):
+    """create_attendance up to the commit: the mark is flushed, not committed.
+
+    Raises HTTPException before writing anything, so a caller batching several
+    writes in one transaction can report the error and carry on.
+    """
+    archive.ensure_writable(attendance.date)
+    student = db.query(models.Student).filter(models.Student.id == attendance.student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    # Bumping the version first takes the write lock, so the mark the rollup
+    # delta is computed from can't change before the write
+    etags.touch(db, attendance.student_id)
+    existing_attendance = db.query(models.Attendance).filter(
+        models.Attendance.student_id == attendance.student_id,
+        models.Attendance.date == attendance.date
+    ).first()
+    
+    if existing_attendance:
+        rollups.record_attendance(db, [
+            (attendance.student_id, attendance.date, 0, int(attendance.present) - int(existing_attendance.present))
+        ])
+        existing_attendance.present = attendance.present
+        db.flush()
+        return schemas.Attendance.from_orm(existing_attendance)
+    else:
+        db_attendance = models.Attendance(**attendance.dict())
+        db.add(db_attendance)
+        rollups.record_attendance(db, [(attendance.student_id, attendance.date, 1, int(attendance.present))])
+        db.flush()
+        return schemas.Attendance.from_orm(db_attendance)
+
+def create_attendance(db: Session, attendance: schemas.AttendanceCreate):
+    result = add_attendance(db, attendance)
+    db.commit()
+    return result
+
+def create_bulk_attendance(db: Session, roll_call: schemas.BulkAttendanceCreate):
+    # If a student appears more than once in the roll-call, the last entry wins
+    marks = {entry.student_id: entry.present for entry in roll_call.records}
+    if not marks:
+        return []
+    archive.ensure_writable(roll_call.date)
+
+    # Take the write lock before reading the current marks, so the created/updated
+    # status and the rollup deltas come from the state the upsert writes over
+    students = [student_id for (student_id,) in db.query(models.Student.id).filter(models.Student.id.in_(marks))]
+    etags.touch(db, *students)
+    # One query resolves which students exist and their current mark for the day (None if unmarked)
+    known = dict(db.query(models.Student.id, models.Attendance.present).outerjoin(
+        models.Attendance,
+        and_(models.Attendance.student_id == models.Student.id, models.Attendance.date == roll_call.date)
+    ).filter(models.Student.id.in_(marks)).all())
+
+    rows = [
+        {"student_id": student_id, "date": roll_call.date, "present": present}
+        for student_id, present in marks.items() if student_id in known
+    ]
+    saved = {}
+    if rows:
+        stmt = database.backend.insert(models.Attendance)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Attendance.student_id, models.Attendance.date],
+            set_={"present": stmt.excluded.present}
+        ).returning(models.Attendance)
+        saved = {
+            attendance.student_id: schemas.Attendance.from_orm(attendance)
+            for attendance in db.scalars(stmt, rows)
+        }
+        rollups.record_attendance(db, [
+            (row["student_id"], roll_call.date, 1, int(row["present"])) if known[row["student_id"]] is None
+            else (row["student_id"], roll_call.date, 0, int(row["present"]) - int(known[row["student_id"]]))
+            for row in rows
+        ])
+        db.commit()
+
+    results = []
+    for student_id in marks:
+        if student_id not in known:
+            results.append(schemas.BulkAttendanceResult(student_id=student_id, status="not_found"))
+        else:
+            results.append(schemas.BulkAttendanceResult(
+                student_id=student_id,
+                status="updated" if known[student_id] is not None else "created",
+                attendance=saved[student_id]
+            ))
+    return results
+
+def add_payment(db: Session, payment: schemas.PaymentHistoryCreate):
+    """create_payment up to the commit, as add_attendance."""
+    archive.ensure_writable(payment.date)
+    student = db.query(models.Student).filter(models.Student.id == payment.student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    due = payment.payment - payment.paid
+    db_payment = models.PaymentHistory(**payment.dict(), due=due)
+    db.add(db_payment)
+    ledger.record_payments(db, [db_payment])
+    etags.touch(db, payment.student_id)
+    db.flush()
+    return schemas.PaymentHistory.from_orm(db_payment)
+
+def create_payment(db: Session, payment: schemas.PaymentHistoryCreate):
+    result = add_payment(db, payment)
+    db.commit()
+    invalidate(payment.student_id)
+    return result
+
+@cached("payment_history")
+def get_student_payment_history(db: Session, student_id: str):
+    try:
+        student = db.query(models.Student).filter(models.Student.id == student_id).first()
+        if not student:
+            raise HTTPException(status_code=404, detail="Student not found")
+        
+        payments = archive.all_rows(
+            db, lambda session: session.query(models.PaymentHistory).filter(models.PaymentHistory.student_id == student_id)
+        )
+        payments.sort(key=lambda payment: payment.id)
+        pydantic_payments = [schemas.PaymentHistory.from_orm(payment) for payment in payments]
+        return schemas.StudentPaymentHistory(student_id=student_id, payments=pydantic_payments)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_student_payment_history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+# Row fields in the order the PaymentHistory and ExamHistory schemas serialize them.
+# The large list endpoints select just these columns and return plain dicts, which
+# the route serializes directly instead of validating a model per row.
+PAYMENT_FIELDS = ("date", "payment", "paid", "total_subjects", "id", "student_id", "due")
+EXAM_FIELDS = ("date", "subject_name", "total_marks", "obtained_marks", "id", "student_id")
+
+def field_columns(model, fields):
+    return [getattr(model, field) for field in fields]
+
+def yearly_payments_query(db: Session, year: int):
+    return db.query(*field_columns(models.PaymentHistory, PAYMENT_FIELDS)).filter(
+        in_period(models.PaymentHistory.date, year)
+    )
+
+def get_yearly_payments(db: Session, year: int):
+    rows = archive.all_rows(db, lambda session: yearly_payments_query(session, year), [year])
+    if not rows:
+        raise HTTPException(status_code=404, detail="No payments found for this year")
+    return row_dicts(PAYMENT_FIELDS, rows)
+
+def get_monthly_payments(db: Session, year: int, month: int):
+    try:
+        payments = db.query(models.PaymentHistory).filter(
+            in_period(models.PaymentHistory.date, year, month)
+        ).all()
+        if not payments:
+            raise HTTPException(status_code=404, detail="No payments found for this month")
+        pydantic_payments = [schemas.PaymentHistory.from_orm(payment) for payment in payments]
+        return schemas.MonthlyPaymentSummary(year=year, month=month, payments=pydantic_payments)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_monthly_payments: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+def due_payments_query(db: Session):
+    return db.query(*field_columns(models.PaymentHistory, PAYMENT_FIELDS)).filter(models.PaymentHistory.due > 0)
+
+def get_due_payments(db: Session):
+    rows = due_payments_query(db).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="No due payments found")
+    return {"payments": row_dicts(PAYMENT_FIELDS, rows)}
+
+def get_monthly_attendance(db: Session, student_id: str, year: int, month: int):
+    period_bounds(year, month)
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    rollup = db.query(models.AttendanceMonthly.total_days, models.AttendanceMonthly.present_days).filter(
+        models.AttendanceMonthly.student_id == student_id,
+        models.AttendanceMonthly.year == year,
+        models.AttendanceMonthly.month == month
+    ).first()
+    total_days, present_days = rollup or (0, 0)
+
+    return schemas.MonthlyAttendance(
+        student_id=student_id,
+        month=month,
+        year=year,
+        total_days=total_days,
+        present_days=present_days
+    )
+
+@cached("monthly_payment")
+def get_monthly_payment(db: Session, student_id: str, year: int, month: int):
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    total_payment, total_paid, total_due = db.query(*payment_totals()).filter(
+        models.PaymentHistory.student_id == student_id,
+        in_period(models.PaymentHistory.date, year, month)
+    ).one()
+
+    return schemas.MonthlyPayment(
+        student_id=student_id,
+        month=month,
+        year=year,
+        total_payment=total_payment,
+        total_paid=total_paid,
+        total_due=total_due
+    )
+
+def get_batch_monthly_attendance(db: Session, kb_batch: str, year: int, month: int):
+    period_bounds(year, month)
+    # Outer join so students with no attendance in the month are listed with zeros
+    rows = db.query(
+        models.Student.id,
+        func.coalesce(models.AttendanceMonthly.total_days, 0),
+        func.coalesce(models.AttendanceMonthly.present_days, 0)
+    ).outerjoin(
+        models.AttendanceMonthly,
+        and_(
+            models.AttendanceMonthly.student_id == models.Student.id,
+            models.AttendanceMonthly.year == year,
+            models.AttendanceMonthly.month == month
+        )
+    ).filter(models.Student.kb_batch == kb_batch).order_by(models.Student.id).all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="No students found for this batch")
+
+    return [
+        schemas.MonthlyAttendance(
+            student_id=student_id,
+            month=month,
+            year=year,
+            total_days=total_days,
+            present_days=present_days
+        )
+        for student_id, total_days, present_days in rows
+    ]
+
+def get_batch_yearly_attendance(db: Session, kb_batch: str, year: int):
+    """Every month with attendance in `year` for every student in the batch."""
+    period_bounds(year)
+    if not db.query(models.Student.id).filter(models.Student.kb_batch == kb_batch).first():
+        raise HTTPException(status_code=404, detail="No students found for this batch")
+
+    rows = db.query(models.AttendanceMonthly).join(models.Student).filter(
+        models.Student.kb_batch == kb_batch,
+        models.AttendanceMonthly.year == year
+    ).order_by(models.AttendanceMonthly.student_id, models.AttendanceMonthly.month).all()
+    return [schemas.MonthlyAttendance.from_orm(row) for row in rows]
+
+def year_range(from_year: int, to_year: int):
+    period_bounds(from_year)
+    period_bounds(to_year)
+    if from_year > to_year:
+        raise HTTPException(status_code=400, detail="from_year must not be after to_year")
+
+def get_attendance_trend(db: Session, student_id: str, from_year: int, to_year: int):
+    year_range(from_year, to_year)
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    rows = db.query(models.AttendanceMonthly).filter(
+        models.AttendanceMonthly.student_id == student_id,
+        models.AttendanceMonthly.year.between(from_year, to_year)
+    ).order_by(models.AttendanceMonthly.year, models.AttendanceMonthly.month).all()
+    return [schemas.MonthlyAttendance.from_orm(row) for row in rows]
+
+def get_batch_attendance_trend(db: Session, kb_batch: str, from_year: int, to_year: int):
+    year_range(from_year, to_year)
+    if not db.query(models.Student.id).filter(models.Student.kb_batch == kb_batch).first():
+        raise HTTPException(status_code=404, detail="No students found for this batch")
+
+    rows = db.query(
+        models.AttendanceMonthly.year,
+        models.AttendanceMonthly.month,
+        func.count(models.AttendanceMonthly.student_id),
+        func.sum(models.AttendanceMonthly.total_days),
+        func.sum(models.AttendanceMonthly.present_days)
+    ).join(models.Student).filter(
+        models.Student.kb_batch == kb_batch,
+        models.AttendanceMonthly.year.between(from_year, to_year)
+    ).group_by(
+        models.AttendanceMonthly.year, models.AttendanceMonthly.month
+    ).order_by(models.AttendanceMonthly.year, models.AttendanceMonthly.month).all()
+
+    return [
+        schemas.BatchMonthlyAttendance(
+            kb_batch=kb_batch,
+            year=year,
+            month=month,
+            students=students,
+            total_days=total_days,
+            present_days=present_days,
+            percentage=round(present_days / total_days * 100, 2) if total_days else 0
+        )
+        for year, month, students, total_days, present_days in rows
+    ]
+
+def get_batch_monthly_payment(db: Session, kb_batch: str, year: int, month: int):
+    rows = db.query(models.Student.id, *payment_totals()).outerjoin(
+        models.PaymentHistory,
+        and_(models.PaymentHistory.student_id == models.Student.id, in_period(models.PaymentHistory.date, year, month))
+    ).filter(models.Student.kb_batch == kb_batch).group_by(models.Student.id).order_by(models.Student.id).all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="No students found for this batch")
+
+    return [
+        schemas.MonthlyPayment(
+            student_id=student_id,
+            month=month,
+            year=year,
+            total_payment=total_payment,
+            total_paid=total_paid,
+            total_due=total_due
+        )
+        for student_id, total_payment, total_paid, total_due in rows
+    ]
+
+def delete_student(db: Session, student_id: str):
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    # Deleting a student detaches their payments and attendance, so their dues and rollups go with them
+    db.query(models.DuesLedger).filter(models.DuesLedger.student_id == student_id).delete(synchronize_session=False)
+    db.query(models.AttendanceMonthly).filter(models.AttendanceMonthly.student_id == student_id).delete(synchronize_session=False)
+    db.query(models.StudentVersion).filter(models.StudentVersion.student_id == student_id).delete(synchronize_session=False)
+    db.delete(student)
+    db.commit()
+    invalidate(student_id)
+    return {"message": "Student deleted successfully"}
+
+def delete_attendance(db: Session, student_id: str, date: date):
+    archive.ensure_writable(date)
+    # Lock first, as add_attendance does, so the mark taken off the rollup is the one deleted
+    etags.touch(db, student_id)
+    attendance = db.query(models.Attendance).filter(
+        models.Attendance.student_id == student_id,
+        models.Attendance.date == date
+    ).first()
+    if not attendance:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Attendance record not found")
+    db.delete(attendance)
+    rollups.record_attendance(db, [(student_id, attendance.date, -1, -int(attendance.present))])
+    db.commit()
+    invalidate(student_id)
+    return {"message": "Attendance record deleted successfully"}
+
+def delete_payment(db: Session, student_id: str, date: date):
+    archive.ensure_writable(date)
+    payment = db.query(models.PaymentHistory).filter(
+        models.PaymentHistory.student_id == student_id,
+        models.PaymentHistory.date == date
+    ).first()
+    if not payment:
+        raise HTTPException(status_code=404, detail="Payment record not found")
+    # The read above isn't in the write transaction: a concurrent request (a
+    # retry or double-click) may have deleted the row since, and must not
+    # take it off the ledger a second time
+    deleted = db.query(models.PaymentHistory).filter(
+        models.PaymentHistory.id == payment.id
+    ).delete(synchronize_session=False)
+    if deleted != 1:
+        db.rollback()
+        raise HTTPException(status_code=404, detail="Payment record not found")
+    ledger.record_payments(db, [payment], sign=-1)
+    etags.touch(db, student_id)
+    db.commit()
+    invalidate(student_id)
+    return {"message": "Payment record deleted successfully"}
+
+def update_student(db: Session, student_id: str, student: schemas.StudentCreate, include: set):
+    db_student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if db_student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    for key, value in student.dict().items():
+        setattr(db_student, key, value)
+    
+    etags.touch(db, student_id)
+    db.commit()
+    invalidate(student_id)
+    db_student = db.query(models.Student).options(*student_load_options(include)).filter(models.Student.id == student_id).one()
+    return student_response(db_student, include)
+
+def get_student_yearly_dues(db: Session, student_id: str):
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    rows = db.query(models.DuesLedger.year, models.DuesLedger.total_due).filter(
+        models.DuesLedger.student_id == student_id
+    ).order_by(models.DuesLedger.year)
+    return {year: float(total_due) for year, total_due in rows}
+
+def get_student_dashboard(db: Session, student_id: str, limit: int, since: Optional[date], year: int, month: int):
+    """Everything the student profile screen shows, in four queries.
+
+    The profile, the month's attendance rollup and exam totals come from one
+    query; the dues by year, the latest `limit` payments and the latest `limit`
+    exams (dated `since` or later) from one each. Payments and exams are read
+    from the live tables, so archived years don't appear among them.
+    """
+    period_bounds(year, month)
+    total_marks, obtained_marks = (
+        db.query(column).filter(
+            models.ExamHistory.student_id == models.Student.id,
+            in_period(models.ExamHistory.date, year, month)
+        ).scalar_subquery()
+        for column in exam_totals()
+    )
+    row = db.query(
+        models.Student,
+        func.coalesce(models.AttendanceMonthly.total_days, 0),
+        func.coalesce(models.AttendanceMonthly.present_days, 0),
+        total_marks,
+        obtained_marks
+    ).outerjoin(models.AttendanceMonthly, and_(
+        models.AttendanceMonthly.student_id == models.Student.id,
+        models.AttendanceMonthly.year == year,
+        models.AttendanceMonthly.month == month
+    )).options(*student_load_options(set())).filter(models.Student.id == student_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    student, total_days, present_days, total_marks, obtained_marks = row
+
+    dues = db.query(models.DuesLedger.year, models.DuesLedger.total_due).filter(
+        models.DuesLedger.student_id == student_id, models.DuesLedger.total_due > ledger.TOLERANCE
+    ).order_by(models.DuesLedger.year)
+
+    def latest(model):
+        query = db.query(model).filter(model.student_id == student_id)
+        if since is not None:
+            query = query.filter(model.date >= since)
+        return query.order_by(model.date.desc(), model.id.desc()).limit(limit)
+
+    return schemas.StudentDashboard(
+        student=schemas.StudentSummary.from_orm(student),
+        year=year,
+        month=month,
+        attendance=schemas.MonthlyAttendance(
+            student_id=student_id, year=year, month=month, total_days=total_days, present_days=present_days
+        ),
+        exam_percentage=exam_percentage(total_marks, obtained_marks) if total_marks is not None else None,
+        dues={due_year: float(total_due) for due_year, total_due in dues},
+        payments=[schemas.PaymentHistory.from_orm(payment) for payment in latest(models.PaymentHistory)],
+        exams=[schemas.ExamHistory.from_orm(exam) for exam in latest(models.ExamHistory)],
+    )
+
+def get_dues(db: Session, cursor: Optional[str], limit: int, year: Optional[int], kb_batch: Optional[str]):
+    """Students with outstanding dues, largest first, from the dues ledger.
+
+    Keyset-paginated on (total_due, student_id); the cursor is "<total_due>|<student_id>".
+    """
+    if year is not None:
+        query = db.query(
+            models.DuesLedger.student_id, models.DuesLedger.total_due.label("total_due")
+        ).filter(models.DuesLedger.year == year)
+    else:
+        query = db.query(
+            models.DuesLedger.student_id, func.sum(models.DuesLedger.total_due).label("total_due")
+        ).group_by(models.DuesLedger.student_id)
+    dues = query.subquery()
+
+    query = db.query(
+        dues.c.student_id, models.Student.name, models.Student.kb_batch, dues.c.total_due
+    ).join(models.Student, models.Student.id == dues.c.student_id).filter(dues.c.total_due > ledger.TOLERANCE)
+    if kb_batch is not None:
+        query = query.filter(models.Student.kb_batch == kb_batch)
+    if cursor is not None:
+        try:
+            after_due, after_id = cursor.split("|", 1)
+            after_due = float(after_due)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(
+            (dues.c.total_due < after_due) | ((dues.c.total_due == after_due) & (dues.c.student_id > after_id))
+        )
+
+    rows = query.order_by(dues.c.total_due.desc(), dues.c.student_id).limit(limit + 1).all()
+    students = [
+        schemas.StudentDue(student_id=student_id, name=name, kb_batch=batch, total_due=due)
+        for student_id, name, batch, due in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last[3]!r}|{last[0]}"
+    return schemas.DuePage(students=students, next_cursor=next_cursor)
+
+def add_exam(db: Session, exam: schemas.ExamHistoryCreate):
+    """create_exam up to the commit, as add_attendance."""
+    archive.ensure_writable(exam.date)
+    student = db.query(models.Student).filter(models.Student.id == exam.student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    db_exam = models.ExamHistory(**exam.dict())
+    db.add(db_exam)
+    etags.touch(db, exam.student_id)
+    db.flush()
+    return schemas.ExamHistory.from_orm(db_exam)
+
+def create_exam(db: Session, exam: schemas.ExamHistoryCreate):
+    result = add_exam(db, exam)
+    db.commit()
+    invalidate(exam.student_id)
+    return result
+
+@cached("exam_history")
+def get_student_exam_history(db: Session, student_id: str):
+    try:
+        student = db.query(models.Student).filter(models.Student.id == student_id).first()
+        if not student:
+            raise HTTPException(status_code=404, detail="Student not found")
+        
+        exams = archive.all_rows(
+            db, lambda session: session.query(models.ExamHistory).filter(models.ExamHistory.student_id == student_id)
+        )
+        exams.sort(key=lambda exam: exam.id)
+        return schemas.StudentExamHistory(student_id=student_id, exams=exams)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in get_student_exam_history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+def yearly_exams_query(db: Session, year: int):
+    return db.query(*field_columns(models.ExamHistory, EXAM_FIELDS)).filter(in_period(models.ExamHistory.date, year))
+
+def get_yearly_exams(db: Session, year: int):
+    rows = archive.all_rows(db, lambda session: yearly_exams_query(session, year), [year])
+    if not rows:
+        raise HTTPException(status_code=404, detail="No exams found for this year")
+    return {"year": year, "exams": row_dicts(EXAM_FIELDS, rows)}
+
+def get_monthly_exams(db: Session, year: int, month: int):
+    exams = db.query(models.ExamHistory).filter(
+        in_period(models.ExamHistory.date, year, month)
+    ).all()
+    if not exams:
+        raise HTTPException(status_code=404, detail="No exams found for this month")
+    return schemas.MonthlyExamSummary(year=year, month=month, exams=exams)
+
+@cached("monthly_exam_percentage")
+def get_monthly_exam_percentage(db: Session, student_id: str, year: int, month: int):
+    student = db.query(models.Student).filter(models.Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    total_marks, obtained_marks = db.query(*exam_totals()).filter(
+        models.ExamHistory.student_id == student_id,
+        in_period(models.ExamHistory.date, year, month)
+    ).one()
+
+    # SUM() over no rows is NULL
+    if total_marks is None:
+        raise HTTPException(status_code=404, detail="No exams found for this student in the specified month")
+
+    return schemas.MonthlyExamPercentage(
+        student_id=student_id,
+        year=year,
+        month=month,
+        percentage=exam_percentage(total_marks, obtained_marks)
+    )
+
+def get_batch_monthly_exam_percentage(db: Session, kb_batch: str, year: int, month: int):
+    # Only students who sat at least one exam in the month have a percentage
+    rows = db.query(models.ExamHistory.student_id, *exam_totals()).join(
+        models.Student, models.Student.id == models.ExamHistory.student_id
+    ).filter(
+        models.Student.kb_batch == kb_batch,
+        in_period(models.ExamHistory.date, year, month)
+    ).group_by(models.ExamHistory.student_id).order_by(models.ExamHistory.student_id).all()
+
+    if not rows:
+        raise HTTPException(status_code=404, detail="No exams found for this batch in the specified month")
+
+    return [
+        schemas.MonthlyExamPercentage(
+            student_id=student_id,
+            year=year,
+            month=month,
+            percentage=exam_percentage(total_marks, obtained_marks)
+        )
+        for student_id, total_marks, obtained_marks in rows
+    ]
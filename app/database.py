@@ -1,37 +1,229 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from starlette.concurrency import run_in_threadpool
+from typing import Union
 from .models import Base
+from .backends import get_backend
+from . import metrics
+import logging
 import os
+import sys
+import zlib
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./kendrobindu.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./kendrobindu.db")
+backend = get_backend(SQLALCHEMY_DATABASE_URL)
+logger = logging.getLogger(__name__)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "sync" runs the route queries on the synchronous engine in Starlette's
+# threadpool; "async" runs them through an AsyncSession on the backend's async
+# driver, so the number of in-flight requests isn't bounded by the threadpool size.
+DATABASE_MODE = os.getenv("KB_DATABASE_MODE", "sync")
+if DATABASE_MODE not in ("async", "sync"):
+    raise ValueError(f"KB_DATABASE_MODE must be 'async' or 'sync', not {DATABASE_MODE!r}")
 
-def get_db():
-    db = SessionLocal()
+def make_engines():
+    sync_engine = create_engine(SQLALCHEMY_DATABASE_URL, **backend.engine_options())
+    event.listen(sync_engine, "connect", backend.on_connect)
+    metrics.instrument(sync_engine)
+    sync_sessions = sessionmaker(autocommit=False, autoflush=False, bind=sync_engine)
+    if DATABASE_MODE != "async":
+        return sync_engine, sync_sessions, None, None
+    async_options = backend.engine_options()
+    async_options.pop("connect_args", None)
+    async_engine = create_async_engine(backend.async_url(), **async_options)
+    event.listen(async_engine.sync_engine, "connect", backend.on_connect)
+    metrics.instrument(async_engine.sync_engine)
+    async_sessions = async_sessionmaker(async_engine, autoflush=False)
+    return sync_engine, sync_sessions, async_engine, async_sessions
+
+# The sync engine is always available: the Excel exports, reports and schema
+# management use it directly. All four are created on first use rather than at
+# import, so importing the app neither builds a pool nor touches the database.
+ENGINE_ATTRIBUTES = ("engine", "SessionLocal", "async_engine", "AsyncSessionLocal")
+_engines = None
+
+def engines():
+    global _engines
+    if _engines is None:
+        _engines = dict(zip(ENGINE_ATTRIBUTES, make_engines()))
+    return _engines
+
+def __getattr__(name):
+    if name in ENGINE_ATTRIBUTES:
+        return engines()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def dispose_engines():
+    global _engines
+    if _engines is None:
+        return
+    if _engines["async_engine"] is not None:
+        await _engines["async_engine"].dispose()
+    _engines["engine"].dispose()
+    _engines = None
+
+class ThreadedSession:
+    """A sync Session exposing AsyncSession.run_sync(), backed by the threadpool."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(metrics.profiled(fn), self.session, *args, **kwargs)
+
+# What get_db() yields; route handlers only rely on `await db.run_sync(fn, ...)`
+DBSession = Union[AsyncSession, ThreadedSession]
+
+async def get_db():
+    AsyncSessionLocal = engines()["AsyncSessionLocal"]
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            yield session
+    else:
+        db = engines()["SessionLocal"]()
+        try:
+            yield ThreadedSession(db)
+        finally:
+            db.close()
+
+def get_sync_db():
+    db = engines()["SessionLocal"]()
     try:
         yield db
     finally:
         db.close()
 
+def derived_tables():
+    # Tables maintained from other tables' rows, with the function that rebuilds each
+    from . import ledger, rollups, search
+    tables = {"dues_ledger": ledger.rebuild, "attendance_monthly": rollups.rebuild}
+    if search.enabled():
+        tables[search.TABLE] = search.rebuild
+    return tables
+
+def derived_table_main(argv, check, rebuild, label):
+    """The `check|rebuild` command line of a derived table's module: `check(db)`
+    returns a list of mismatches, `rebuild(db)` refills the table and `label`
+    names it in the output."""
+    if len(argv) != 1 or argv[0] not in ("check", "rebuild"):
+        module = sys.modules[rebuild.__module__].__spec__.name  # app.ledger even when run as __main__
+        print(f"usage: python -m {module} check|rebuild", file=sys.stderr)
+        return 2
+    migrate()
+    db = engines()["SessionLocal"]()
+    try:
+        if argv[0] == "rebuild":
+            rebuild(db)
+            db.commit()
+            print(f"{label} rebuilt")
+            return 0
+        problems = check(db)
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} mismatches")
+        return 1 if problems else 0
+    finally:
+        db.close()
+
 def create_tables():
+    engine = engines()["engine"]
+    with engine.connect() as conn:
+        existing = set(inspect(conn).get_table_names())
     Base.metadata.create_all(bind=engine)
+    migrate_indexes()
+    from . import search
+    search.create_index(engine)
+    # Fill newly added derived tables from the rows already recorded
+    rebuilds = [rebuild for name, rebuild in derived_tables().items() if name not in existing]
+    if rebuilds:
+        with Session(engine) as db:
+            for rebuild in rebuilds:
+                rebuild(db)
+            db.commit()
 
-def reset_database():
-    global engine
-    global SessionLocal
+def schema_version():
+    """A fingerprint of the schema create_tables() builds: the DDL of every table
+    and index on the models plus the search index. Any change to them changes it."""
+    from . import search
+    dialect = engines()["engine"].dialect
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)))
+        statements.extend(
+            str(CreateIndex(index).compile(dialect=dialect)) for index in sorted(table.indexes, key=lambda index: index.name)
+        )
+    if search.enabled():
+        statements.extend(search.DDL)
+    # Positive and 32-bit, to fit SQLite's user_version
+    return zlib.crc32("\n".join(statements).encode()) & 0x7FFFFFFF
 
-    # Close all connections
-    engine.dispose()
+def migrate(force=False):
+    """Run create_tables() unless the database is already stamped with the current
+    schema_version(), then stamp it. Returns whether anything ran.
 
-    # Remove the database file
-    if os.path.exists("./kendrobindu.db"):
-        os.remove("./kendrobindu.db")
+    Startup calls this, so a restart against an up-to-date database costs a single
+    read. With several workers, run `python -m app.database migrate` before starting
+    them so they don't all migrate a new database at once.
+    """
+    version = schema_version()
+    engine = engines()["engine"]
+    if not force:
+        with engine.connect() as conn:
+            if backend.schema_version(conn) == version:
+                return False
+    create_tables()
+    with engine.begin() as conn:
+        backend.set_schema_version(conn, version)
+    return True
 
-    # Recreate the engine and session
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def migrate_indexes():
+    # create_all() skips tables that already exist, so databases created before an
+    # index was declared on the models never get it. Add any missing ones here.
+    with engines()["engine"].begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.name == "ix_attendances_student_id_date":
+                    # The unique index can't be built over duplicate rows; keep the
+                    # first record for each day, the one create_attendance updated
+                    removed = conn.execute(text(
+                        "DELETE FROM attendances WHERE id NOT IN "
+                        "(SELECT MIN(id) FROM attendances GROUP BY student_id, date)"
+                    )).rowcount
+                    if removed:
+                        logger.warning(
+                            "Removed %d duplicate attendance rows, keeping the first mark of each "
+                            "student's day, before adding %s", removed, index.name
+                        )
+                index.create(bind=conn)
 
-    # Recreate tables
+def reset_database():
+    # Drop and recreate (or truncate) every table through the backend, so this
+    # works the same whichever database is configured
+    from . import search, archive
+    engine = engines()["engine"]
+    archive.remove_archives()
+    search.drop_index(engine)
+    backend.reset(engine, Base.metadata)
     create_tables()
+
+def bulk_insert(db: Session, model, rows):
+    """Insert column dicts for `model` within the session's transaction using the
+    backend's native bulk path (executemany on SQLite, COPY on PostgreSQL)."""
+    backend.bulk_insert(db.connection(), model.__table__, rows)
+
+def main(argv):
+    if argv != ["migrate"]:
+        print("usage: python -m app.database migrate", file=sys.stderr)
+        return 2
+    migrate(force=True)
+    print(f"Schema is at version {schema_version()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,51 @@
+"""ETags for per-student resources.
+
+A student's ETag is derived from a change counter in student_versions, which
+every write through the API bumps in the same transaction as the change, plus
+the row count and highest id of the history table the resource is built from
+(so rows added outside the API also change it) and the student's name. It takes
+one indexed query, far cheaper than building the response it stands for.
+"""
+import hashlib
+from typing import Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from . import models, database
+
+def touch(db: Session, *student_ids):
+    """Bump the change counter of each student within the current transaction."""
+    if not student_ids:
+        return
+    table = models.StudentVersion.__table__
+    stmt = database.backend.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.student_id],
+        set_={"version": table.c.version + 1},
+    )
+    db.execute(stmt, [{"student_id": student_id, "version": 1} for student_id in set(student_ids)])
+
+def student_etag(db: Session, student_id: str, model, representation="json") -> Optional[str]:
+    """A weak ETag for `student_id`'s rows of `model`, or None if the student doesn't exist."""
+    rows = db.query(model).filter(model.student_id == student_id)
+    row = db.query(
+        models.Student.name,
+        func.coalesce(models.StudentVersion.version, 0),
+        rows.with_entities(func.count(model.id)).scalar_subquery(),
+        rows.with_entities(func.max(model.id)).scalar_subquery()
+    ).outerjoin(
+        models.StudentVersion, models.StudentVersion.student_id == models.Student.id
+    ).filter(models.Student.id == student_id).first()
+    if row is None:
+        return None
+    digest = hashlib.sha1(repr((student_id, model.__tablename__, representation, *row)).encode()).hexdigest()
+    # Weak, since the gzip middleware may re-encode the body
+    return f'W/"{digest[:20]}"'
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value matches `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
@@ -0,0 +1,152 @@
+"""Excel exports of student histories.
+
+Workbooks are created in openpyxl's write-only mode, so rows are streamed to
+disk as they are appended and memory stays flat however long a history is.
+Styles are registered once per workbook as named styles built from the shared
+objects below, instead of styling and bordering every cell after the fact.
+"""
+import os
+import tempfile
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.chart import LineChart, Reference
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+THIN_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_FILL = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+DUE_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+CLEARED_FILL = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+CENTER = Alignment(horizontal='center', vertical='center')
+
+# name -> (font, fill, alignment, border, number_format)
+STYLES = {
+    "kb_title": (Font(size=16, bold=True), None, CENTER, None, None),
+    "kb_header": (Font(bold=True), HEADER_FILL, CENTER, THIN_BORDER, None),
+    "kb_date": (None, None, Alignment(horizontal='center'), THIN_BORDER, "yyyy-mm-dd"),
+    "kb_center": (None, None, Alignment(horizontal='center'), THIN_BORDER, None),
+    "kb_left": (None, None, Alignment(horizontal='left'), THIN_BORDER, None),
+    "kb_right": (None, None, Alignment(horizontal='right'), THIN_BORDER, None),
+    "kb_due": (Font(color="9C0006"), DUE_FILL, Alignment(horizontal='right'), THIN_BORDER, None),
+    "kb_cleared": (Font(color="006100"), CLEARED_FILL, Alignment(horizontal='right'), THIN_BORDER, None),
+    "kb_total": (Font(bold=True), None, None, None, None),
+}
+
+PAYMENT_HEADERS = ["Date", "Payment", "Paid", "Due", "Total Subjects"]
+EXAM_HEADERS = ["Date", "Subject", "Total Marks", "Obtained Marks", "Percentage"]
+
+def new_workbook():
+    wb = Workbook(write_only=True)
+    for name, (font, fill, alignment, border, number_format) in STYLES.items():
+        style = NamedStyle(name=name)
+        if font is not None:
+            style.font = font
+        if fill is not None:
+            style.fill = fill
+        if alignment is not None:
+            style.alignment = alignment
+        if border is not None:
+            style.border = border
+        if number_format is not None:
+            style.number_format = number_format
+        wb.add_named_style(style)
+    return wb
+
+def percentage(total_marks, obtained_marks):
+    percentage = (obtained_marks / total_marks) * 100 if total_marks else 0
+    return round(percentage, 2)
+
+def styled(sheet, value, style):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.style = style
+    return cell
+
+def start_sheet(wb, title, heading, headers):
+    """Create a sheet with the merged heading row and the column header row."""
+    sheet = wb.create_sheet(title)
+    # Column widths and merges must be set before the first row is written
+    for col in range(1, len(headers) + 1):
+        sheet.column_dimensions[get_column_letter(col)].width = 15
+    sheet.merged_cells.add(f"A1:{get_column_letter(len(headers))}1")
+    sheet.append([styled(sheet, heading, "kb_title")])
+    sheet.append([])
+    sheet.append([styled(sheet, header, "kb_header") for header in headers])
+    return sheet
+
+def write_payment_history(wb, student_id, student_name, payments, title="Payment History"):
+    """Append a payment history sheet.
+
+    `payments` is an iterable of (date, payment, paid, due, total_subjects) rows;
+    it is consumed once, so it can be a streaming query.
+    """
+    sheet = start_sheet(wb, title, f"Payment History for {student_name} (ID: {student_id})", PAYMENT_HEADERS)
+
+    total_payment = 0
+    total_paid = 0
+    total_due = 0
+    for payment_date, payment, paid, due, total_subjects in payments:
+        sheet.append([
+            styled(sheet, payment_date, "kb_date"),
+            styled(sheet, payment, "kb_right"),
+            styled(sheet, paid, "kb_right"),
+            styled(sheet, due, "kb_due" if due > 0 else "kb_cleared"),
+            styled(sheet, total_subjects, "kb_center"),
+        ])
+        total_payment += payment
+        total_paid += paid
+        total_due += due
+
+    sheet.append([])
+    sheet.append([styled(sheet, value, "kb_total") for value in ("Total", total_payment, total_paid, total_due)])
+    return total_payment, total_paid, total_due
+
+def write_exam_history(wb, student_id, student_name, exams, title="Exam History"):
+    """Append an exam history sheet with a performance chart.
+
+    `exams` is an iterable of (date, subject_name, total_marks, obtained_marks)
+    rows in date order.
+    """
+    sheet = start_sheet(wb, title, f"Exam History for {student_name} (ID: {student_id})", EXAM_HEADERS)
+
+    last_row = 3
+    for exam_date, subject_name, total_marks, obtained_marks in exams:
+        sheet.append([
+            styled(sheet, exam_date, "kb_date"),
+            styled(sheet, subject_name, "kb_left"),
+            styled(sheet, total_marks, "kb_right"),
+            styled(sheet, obtained_marks, "kb_right"),
+            styled(sheet, percentage(total_marks, obtained_marks), "kb_right"),
+        ])
+        last_row += 1
+
+    chart = LineChart()
+    chart.title = "Exam Performance Over Time"
+    chart.y_axis.title = "Percentage"
+    chart.x_axis.title = "Exams"
+    chart.add_data(Reference(sheet, min_col=5, min_row=3, max_row=last_row, max_col=5), titles_from_data=True)
+    chart.set_categories(Reference(sheet, min_col=1, min_row=4, max_row=last_row))
+    sheet.add_chart(chart, "G3")
+
+def save_workbook(wb):
+    """Save the workbook to a temporary file and return its path."""
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            wb.save(tmp)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+def xlsx_response(path, filename):
+    """Stream a saved workbook to the client and delete it once sent."""
+    return FileResponse(
+        path,
+        media_type=XLSX_MEDIA_TYPE,
+        filename=filename,
+        background=BackgroundTask(os.remove, path)
+    )
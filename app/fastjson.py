@@ -0,0 +1,70 @@
+"""Fast path for endpoints returning large lists of rows.
+
+Instead of building a Pydantic model per ORM object, these endpoints select
+plain column tuples and serialize them straight to bytes: as one JSON document
+with OrjsonResponse, or as newline-delimited JSON written while the rows are
+still being fetched with ndjson_response (`?stream=1`), so memory stays flat
+however many rows there are.
+
+orjson is used when installed and falls back to the standard library.
+"""
+import json
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from . import database
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+STREAM_BATCH = 5000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), default=str).encode()
+
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+def row_dicts(fields, rows):
+    return [dict(zip(fields, row)) for row in rows]
+
+def ndjson_response(build_query, fields, not_found, years=()):
+    """Stream build_query(session) as NDJSON, one object per row, followed by its
+    rows in the archives of `years`.
+
+    The rows are read on a session owned by the stream, which stays open until
+    the last row is written. Raises a 404 with `not_found` when there are no rows.
+    """
+    from . import archive
+    db = database.SessionLocal()
+    try:
+        rows = archive.iter_rows(db, build_query, years, STREAM_BATCH)
+        first = next(rows, None)
+    except BaseException:
+        db.close()
+        raise
+    if first is None:
+        rows.close()
+        db.close()
+        raise HTTPException(status_code=404, detail=not_found)
+
+    def lines():
+        try:
+            batch = [first]
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= STREAM_BATCH:
+                    yield b"".join(dumps(dict(zip(fields, row))) + b"\n" for row in batch)
+                    batch = []
+            if batch:
+                yield b"".join(dumps(dict(zip(fields, row))) + b"\n" for row in batch)
+        finally:
+            rows.close()
+            db.close()
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,131 @@
+"""Group commit for single-row writes.
+
+SQLite lets one writer in at a time and every commit waits for the disk, so a
+burst of attendance marks posted one request each queues on the write lock.
+With KB_GROUP_COMMIT=1, POST /attendance/, /payments/ and /exams/ hand their
+write to a single writer task instead: it takes every write waiting in its
+queue (up to KB_GROUP_COMMIT_SIZE, waiting at most KB_GROUP_COMMIT_MS for more
+to arrive), applies them in order on one session in the threadpool, commits
+once and then answers each request with its own row.
+
+Each request still gets the response or error it would have got on its own.
+The crud add_* functions raise their HTTPExceptions (unknown student, archived
+year) before writing anything, so those fail just their own request. Any other
+error rolls the batch back and the writer retries its writes one commit each,
+so the error reaches only the request that caused it.
+
+Every response is sent after its commit, and the writes are applied in arrival
+order. A request whose client goes away while it is queued is still written,
+as it would be once handed to the threadpool.
+"""
+import asyncio
+import logging
+import os
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from . import database, cache
+
+ENABLED = os.getenv("KB_GROUP_COMMIT", "0") == "1"
+MAX_BATCH = int(os.getenv("KB_GROUP_COMMIT_SIZE", "200"))
+MAX_WAIT = float(os.getenv("KB_GROUP_COMMIT_MS", "2")) / 1000
+
+logger = logging.getLogger(__name__)
+
+class GroupCommitWriter:
+    def __init__(self, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.batches = 0
+        self.writes = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """Finish the writes already queued, then stop."""
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, fn, *args):
+        """Apply fn(session, *args) in the next batch and return its result once committed."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, future))
+        return await future
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                outcomes = await run_in_threadpool(self.commit_batch, [(fn, args) for fn, args, _ in batch])
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for _ in batch:
+                self.queue.task_done()
+            self.batches += 1
+            self.writes += len(batch)
+
+    def commit_batch(self, writes):
+        """Apply `writes` in one transaction; returns an (ok, result or exception) per write."""
+        db = database.SessionLocal()
+        try:
+            outcomes = []
+            for fn, args in writes:
+                try:
+                    outcomes.append((True, fn(db, *args)))
+                except HTTPException as e:
+                    outcomes.append((False, e))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(writes) == 1:
+                return [(False, e)]
+            logger.warning("Group commit of %d writes failed (%s); retrying them one by one", len(writes), e)
+            return [self.commit_batch([write])[0] for write in writes]
+        finally:
+            db.close()
+        cache.invalidate(*{result.student_id for ok, result in outcomes if ok})
+        return outcomes
+
+writer = None
+
+async def start():
+    global writer
+    if ENABLED:
+        writer = GroupCommitWriter()
+        writer.start()
+
+async def stop():
+    global writer
+    if writer is not None:
+        await writer.stop()
+        writer = None
@@ -0,0 +1,225 @@
+"""Bulk import of students, payments and exams from CSV or XLSX files.
+
+Files are parsed as a stream and handled in chunks: each chunk is validated
+with the same *Create schemas the single-record endpoints use, foreign keys
+are checked against an in-memory set of student IDs, and the valid rows are
+written with one bulk insert and committed. Invalid rows are skipped and
+reported back with their row number.
+
+The file is checked before anything is written: a CSV must decode as UTF-8 and
+an XLSX must open as a workbook, or the import is refused outright. If a file
+turns out to be unreadable further on, the rows before that point are imported
+and the row where reading stopped is reported as an error.
+"""
+import codecs
+import csv
+import io
+import zipfile
+import zlib
+from datetime import datetime
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from . import models, schemas, database, student_ids, ledger, cache, etags, archive
+
+IMPORT_CHUNK_SIZE = 1000
+
+# kind -> (schema validating a row, model written to)
+IMPORT_KINDS = {
+    "students": (schemas.StudentCreate, models.Student),
+    "payments": (schemas.PaymentHistoryCreate, models.PaymentHistory),
+    "exams": (schemas.ExamHistoryCreate, models.ExamHistory),
+}
+
+def clean_row(row):
+    # Blank cells mean "not given", so optional fields fall back to their defaults
+    return {
+        key.strip().lower(): value
+        for key, value in row.items()
+        if key and value is not None and value != ""
+    }
+
+class UnreadableRow(ValueError):
+    """Reading the file failed at `row`; nothing from there on can be imported."""
+    def __init__(self, row, message):
+        super().__init__(message)
+        self.row = row
+
+# What openpyxl raises on a damaged workbook: bad zip entries, truncated data
+# or malformed XML (ElementTree's and lxml's parse errors are SyntaxErrors)
+XLSX_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, KeyError, ValueError, SyntaxError)
+
+def check_utf8(file):
+    """Raise ValueError unless the whole of `file` decodes as UTF-8, then rewind it."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    offset = 0
+    while True:
+        data = file.read(1 << 20)
+        try:
+            decoder.decode(data, final=not data)
+        except UnicodeDecodeError as e:
+            raise ValueError(f"CSV files must be UTF-8 encoded; byte {offset + e.start} isn't valid UTF-8") from e
+        if not data:
+            break
+        offset += len(data)
+    file.seek(0)
+
+def iter_csv_rows(file):
+    """(row_number, values) for each row of a CSV file with a header row; the
+    file is checked to be UTF-8 up front."""
+    check_utf8(file)
+    return csv_rows(file)
+
+def csv_rows(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    row_number = 1
+    try:
+        for row_number, row in enumerate(csv.DictReader(text), start=2):
+            yield row_number, clean_row(row)
+    except csv.Error as e:
+        raise UnreadableRow(row_number + 1, f"Unreadable CSV: {e}") from e
+    finally:
+        text.detach()
+
+def iter_xlsx_rows(file):
+    """(row_number, values) for each row of the first sheet of an XLSX file with a
+    header row; the workbook is opened and the header read up front."""
+    from openpyxl import load_workbook
+    try:
+        wb = load_workbook(file, read_only=True, data_only=True)
+    except XLSX_ERRORS as e:
+        raise ValueError(f"Not a readable .xlsx workbook: {e}") from e
+    if not wb.worksheets:
+        wb.close()
+        raise ValueError("The workbook has no sheets")
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(cell) if cell is not None else None for cell in next(rows, [])]
+    except XLSX_ERRORS as e:
+        wb.close()
+        raise ValueError(f"Not a readable .xlsx workbook: {e}") from e
+    except BaseException:
+        wb.close()
+        raise
+    return xlsx_rows(wb, header, rows)
+
+def xlsx_rows(wb, header, rows):
+    row_number = 1
+    try:
+        for row_number, cells in enumerate(rows, start=2):
+            values = {}
+            for key, cell in zip(header, cells):
+                # Excel stores dates as datetimes and may type IDs or batches as numbers
+                if isinstance(cell, datetime):
+                    cell = cell.date()
+                elif cell is not None and not hasattr(cell, "isoformat"):
+                    cell = str(cell)
+                values[key] = cell
+            if any(value is not None for value in values.values()):
+                yield row_number, clean_row(values)
+    except XLSX_ERRORS as e:
+        raise UnreadableRow(row_number + 1, f"Unreadable .xlsx data: {e}") from e
+    finally:
+        wb.close()
+
+def iter_file_rows(file, filename):
+    """(row_number, values) for each row of an uploaded file; raises ValueError
+    for a file type that can't be imported or a file that can't be read."""
+    if filename.lower().endswith(".csv"):
+        return iter_csv_rows(file)
+    if filename.lower().endswith(".xlsx"):
+        return iter_xlsx_rows(file)
+    raise ValueError("Only .csv and .xlsx files can be imported")
+
+def validation_message(error: ValidationError):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" for detail in error.errors()
+    )
+
+def assign_student_ids(db: Session, mappings):
+    # One counter update per batch in the chunk rather than one per student
+    by_batch = {}
+    for mapping in mappings:
+        by_batch.setdefault(mapping["hsc_batch"], []).append(mapping)
+    for hsc_batch, batch_mappings in by_batch.items():
+        for mapping, student_id in zip(batch_mappings, student_ids.reserve_ids(db, hsc_batch, len(batch_mappings))):
+            mapping["id"] = student_id
+
+def read_chunk(rows):
+    """Up to IMPORT_CHUNK_SIZE rows, and the UnreadableRow that ended the file, if any."""
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == IMPORT_CHUNK_SIZE:
+                break
+    except UnreadableRow as e:
+        return chunk, e
+    return chunk, None
+
+def import_rows(db: Session, kind, rows):
+    """Import an iterable of (row_number, values) and return a schemas.ImportReport."""
+    schema, model = IMPORT_KINDS[kind]
+    report = schemas.ImportReport(kind=kind)
+    if kind == "students":
+        report.created_ids = []
+    else:
+        student_ids = {student_id for (student_id,) in db.query(models.Student.id)}
+        archived = set(archive.archived_years())
+
+    rows = iter(rows)
+    unreadable = None
+    while unreadable is None:
+        chunk, unreadable = read_chunk(rows)
+        if not chunk:
+            break
+        report.total_rows += len(chunk)
+
+        mappings = []
+        row_numbers = []
+        for row_number, values in chunk:
+            try:
+                record = schema(**values)
+            except ValidationError as e:
+                report.errors.append(schemas.ImportRowError(row=row_number, error=validation_message(e)))
+                continue
+            if kind != "students" and record.student_id not in student_ids:
+                report.errors.append(schemas.ImportRowError(row=row_number, error=f"Student not found: {record.student_id}"))
+                continue
+            if kind != "students" and record.date.year in archived:
+                report.errors.append(schemas.ImportRowError(row=row_number, error=f"{record.date.year} is archived"))
+                continue
+            mapping = record.dict()
+            if kind == "payments":
+                mapping["due"] = record.payment - record.paid
+            mappings.append(mapping)
+            row_numbers.append(row_number)
+
+        try:
+            if kind == "students":
+                assign_student_ids(db, mappings)
+            database.bulk_insert(db, model, mappings)
+            if kind == "payments":
+                ledger.record_payments(db, mappings)
+            if kind != "students":
+                etags.touch(db, *(mapping["student_id"] for mapping in mappings))
+            db.commit()
+            if kind != "students":
+                cache.invalidate(*{mapping["student_id"] for mapping in mappings})
+        except SQLAlchemyError as e:
+            db.rollback()
+            message = f"Database error: {e.__class__.__name__}"
+            report.errors.extend(schemas.ImportRowError(row=row_number, error=message) for row_number in row_numbers)
+            continue
+
+        report.inserted += len(mappings)
+        if kind == "students":
+            report.created_ids.extend(mapping["id"] for mapping in mappings)
+
+    if unreadable is not None:
+        report.total_rows += 1
+        report.errors.append(schemas.ImportRowError(row=unreadable.row, error=str(unreadable)))
+    return report
+
+def import_file(db: Session, kind, file, filename):
+    return import_rows(db, kind, iter_file_rows(file, filename))
@@ -0,0 +1,112 @@
+"""Dues ledger: outstanding dues per student per year.
+
+The dues_ledger table holds SUM(due) and the number of payments for every
+(student, year) that has payments. create_payment, delete_payment and the
+payments importer update it in the same transaction as the payment rows, so
+due listings and yearly dues read one row per student-year instead of
+aggregating the whole payment history.
+
+Years moved to the archive (app.archive) keep their ledger rows; check and
+rebuild leave them alone. Rows inserted behind the API's back (e.g. by hand or
+a restore) leave the ledger stale; check and rebuild it with
+
+    python -m app.ledger check
+    python -m app.ledger rebuild
+"""
+import sys
+from collections import defaultdict
+from sqlalchemy import extract, func
+from sqlalchemy.orm import Session
+from . import models, database, archive
+
+# Float sums of currency amounts carry rounding noise; differences below this are equal
+TOLERANCE = 0.005
+
+def record_payments(db: Session, payments, sign=1):
+    """Add (sign=1) or remove (sign=-1) payments from the ledger.
+
+    `payments` are PaymentHistory rows or mappings with student_id, date and due.
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for payment in payments:
+        if isinstance(payment, dict):
+            student_id, day, due = payment["student_id"], payment["date"], payment["due"]
+        else:
+            student_id, day, due = payment.student_id, payment.date, payment.due
+        delta = deltas[(student_id, day.year)]
+        delta[0] += sign * due
+        delta[1] += sign
+    if not deltas:
+        return
+
+    table = models.DuesLedger.__table__
+    stmt = database.backend.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.student_id, table.c.year],
+        set_={
+            "total_due": table.c.total_due + stmt.excluded.total_due,
+            "payment_count": table.c.payment_count + stmt.excluded.payment_count,
+        },
+    )
+    db.execute(stmt, [
+        {"student_id": student_id, "year": year, "total_due": total_due, "payment_count": count}
+        for (student_id, year), (total_due, count) in deltas.items()
+    ])
+    if sign < 0:
+        # A year with no payments left has no entry, as in a rebuilt ledger
+        db.query(models.DuesLedger).filter(
+            models.DuesLedger.student_id.in_({student_id for student_id, _ in deltas}),
+            models.DuesLedger.payment_count <= 0
+        ).delete(synchronize_session=False)
+
+def computed_ledger(db: Session, archived=()):
+    """The ledger as aggregated from payment_history, except for `archived` years."""
+    year = extract("year", models.PaymentHistory.date)
+    return db.query(
+        models.PaymentHistory.student_id,
+        year,
+        func.sum(models.PaymentHistory.due),
+        func.count(models.PaymentHistory.id)
+    ).filter(
+        models.PaymentHistory.student_id.isnot(None),
+        year.notin_(archived)
+    ).group_by(models.PaymentHistory.student_id, year)
+
+def rebuild(db: Session):
+    """Replace the ledger of unarchived years with one aggregated from payment_history. Commit is left to the caller."""
+    archived = archive.archived_years()
+    db.query(models.DuesLedger).filter(models.DuesLedger.year.notin_(archived)).delete(synchronize_session=False)
+    db.execute(
+        models.DuesLedger.__table__.insert().from_select(
+            ["student_id", "year", "total_due", "payment_count"], computed_ledger(db, archived)
+        )
+    )
+
+def check(db: Session):
+    """Compare the ledger with payment_history and return a list of mismatch descriptions."""
+    archived = archive.archived_years()
+    expected = {(student_id, int(year)): (total_due, count) for student_id, year, total_due, count in computed_ledger(db, archived)}
+    actual = {
+        (row.student_id, row.year): (row.total_due, row.payment_count)
+        for row in db.query(models.DuesLedger).filter(models.DuesLedger.year.notin_(archived))
+    }
+    problems = []
+    for key in sorted(expected.keys() | actual.keys()):
+        if key not in actual:
+            problems.append(f"{key[0]} {key[1]}: missing from ledger")
+        elif key not in expected:
+            problems.append(f"{key[0]} {key[1]}: in ledger but no payments")
+        else:
+            (expected_due, expected_count), (actual_due, actual_count) = expected[key], actual[key]
+            if expected_count != actual_count or abs(expected_due - actual_due) > TOLERANCE:
+                problems.append(
+                    f"{key[0]} {key[1]}: ledger has due {actual_due} over {actual_count} payments, "
+                    f"payment_history has {expected_due} over {expected_count}"
+                )
+    return problems
+
+def main(argv):
+    return database.derived_table_main(argv, check, rebuild, "Dues ledger")
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
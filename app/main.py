@@ -1,490 +1,350 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, UploadFile, File, Header, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import extract, func
-from . import models, schemas, database
-from typing import List
-from datetime import date, timedelta
-import random
-import string
-from fastapi.encoders import jsonable_encoder
+from . import models, schemas, database, crud, reports, importer, cache, etags, fastjson, metrics, search, archive, group_commit
+from typing import List, Optional, Literal
+from datetime import date
 import logging
-from collections import defaultdict
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-import tempfile
-import os
-from openpyxl.chart import LineChart, Reference
-
-app = FastAPI()
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from contextlib import asynccontextmanager
+import asyncio
 
-# Create tables
-database.create_tables()
+# openpyxl (app.excel) and NumPy (app.analytics) are imported by the routes that
+# use them, on first use, so building the app doesn't pay for them.
+# Workbooks are already zip archives; this is excel.XLSX_MEDIA_TYPE, spelled out
+# so the app can be configured without importing openpyxl.
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-def generate_unique_id(hsc_batch):
-    letters = string.ascii_uppercase + string.digits
-    unique_part = ''.join(random.choice(letters) for _ in range(6))
-    return f"{unique_part}-{hsc_batch}"
+logger = logging.getLogger(__name__)
 
-@app.post("/reset-database")
-def reset_database():
-    database.reset_database()
+router = APIRouter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrates only when the database isn't stamped with the current schema
+    await run_in_threadpool(database.migrate)
+    await group_commit.start()
+    yield
+    await group_commit.stop()
+    reports.shutdown_pool()
+    await database.dispose_engines()
+
+def create_app() -> FastAPI:
+    """Build the application. Nothing touches the database until startup."""
+    logging.basicConfig(level=logging.INFO)
+    app = FastAPI(lifespan=lifespan)
+    # Compress large JSON lists; workbooks are already compressed
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=1000,
+        compresslevel=6,
+        exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES + (XLSX_MEDIA_TYPE,)
+    )
+    # Outermost, so the latency it records includes compression
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+def student_includes(include: Optional[str] = Query(None, description="Comma-separated histories to embed: payments, exams")):
+    requested = {name.strip() for name in include.split(",") if name.strip()} if include else set()
+    unknown = requested - crud.STUDENT_INCLUDES.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    return requested
+
+@router.post("/reset-database")
+async def reset_database():
+    await run_in_threadpool(database.reset_database)
+    cache.clear()
     return {"message": "Database reset successfully"}
 
-@app.post("/students/", response_model=schemas.Student)
-def create_student(student: schemas.StudentCreate, db: Session = Depends(database.get_db)):
-    unique_id = generate_unique_id(student.hsc_batch)
-    db_student = models.Student(id=unique_id, **student.dict())
-    db.add(db_student)
-    db.commit()
-    db.refresh(db_student)
-    return db_student
-
-@app.get("/students/", response_model=List[schemas.Student])
-def get_students(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
-    students = db.query(models.Student).offset(skip).limit(limit).all()
-    return students
-
-@app.get("/students/{student_id}", response_model=schemas.Student)
-def get_student(student_id: str, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if student is None:
-        raise HTTPException(status_code=404, detail="Student not found")
-    return student
-
-@app.get("/students/batch/{kb_batch}", response_model=List[schemas.Student])
-def get_students_by_batch(kb_batch: str, db: Session = Depends(database.get_db)):
-    students = db.query(models.Student).filter(models.Student.kb_batch == kb_batch).all()
-    if not students:
-        raise HTTPException(status_code=404, detail="No students found for this batch")
-    return students
-
-@app.post("/attendance/", response_model=schemas.Attendance)
-def create_attendance(attendance: schemas.AttendanceCreate, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == attendance.student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    existing_attendance = db.query(models.Attendance).filter(
-        models.Attendance.student_id == attendance.student_id,
-        models.Attendance.date == attendance.date
-    ).first()
-    
-    if existing_attendance:
-        existing_attendance.present = attendance.present
-        db.commit()
-        db.refresh(existing_attendance)
-        return existing_attendance
-    else:
-        db_attendance = models.Attendance(**attendance.dict())
-        db.add(db_attendance)
-        db.commit()
-        db.refresh(db_attendance)
-        return db_attendance
-
-@app.post("/payments/", response_model=schemas.PaymentHistory)
-def create_payment(payment: schemas.PaymentHistoryCreate, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == payment.student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    due = payment.payment - payment.paid
-    db_payment = models.PaymentHistory(**payment.dict(), due=due)
-    db.add(db_payment)
-    db.commit()
-    db.refresh(db_payment)
-    return db_payment
-
-@app.get("/payments/student/{student_id}", response_model=schemas.StudentPaymentHistory)
-def get_student_payment_history(student_id: str, db: Session = Depends(database.get_db)):
-    try:
-        student = db.query(models.Student).filter(models.Student.id == student_id).first()
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found")
-        
-        payments = db.query(models.PaymentHistory).filter(models.PaymentHistory.student_id == student_id).all()
-        pydantic_payments = [schemas.PaymentHistory.from_orm(payment) for payment in payments]
-        return schemas.StudentPaymentHistory(student_id=student_id, payments=pydantic_payments)
-    except Exception as e:
-        logger.error(f"Error in get_student_payment_history: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.get("/payments/year/{year}", response_model=List[schemas.PaymentHistory])
-def get_yearly_payments(year: int, db: Session = Depends(database.get_db)):
-    try:
-        payments = db.query(models.PaymentHistory).filter(extract('year', models.PaymentHistory.date) == year).all()
-        if not payments:
-            raise HTTPException(status_code=404, detail="No payments found for this year")
-        return [schemas.PaymentHistory.from_orm(payment) for payment in payments]
-    except Exception as e:
-        logger.error(f"Error in get_yearly_payments: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.get("/payments/month/{year}/{month}", response_model=schemas.MonthlyPaymentSummary)
-def get_monthly_payments(year: int, month: int, db: Session = Depends(database.get_db)):
-    try:
-        payments = db.query(models.PaymentHistory).filter(
-            extract('year', models.PaymentHistory.date) == year,
-            extract('month', models.PaymentHistory.date) == month
-        ).all()
-        if not payments:
-            raise HTTPException(status_code=404, detail="No payments found for this month")
-        pydantic_payments = [schemas.PaymentHistory.from_orm(payment) for payment in payments]
-        return schemas.MonthlyPaymentSummary(year=year, month=month, payments=pydantic_payments)
-    except Exception as e:
-        logger.error(f"Error in get_monthly_payments: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.get("/payments/due", response_model=schemas.DuePaymentSummary)
-def get_due_payments(db: Session = Depends(database.get_db)):
-    try:
-        payments = db.query(models.PaymentHistory).filter(models.PaymentHistory.due > 0).all()
-        if not payments:
-            raise HTTPException(status_code=404, detail="No due payments found")
-        
-        pydantic_payments = [schemas.PaymentHistory.from_orm(payment) for payment in payments]
-        return schemas.DuePaymentSummary(payments=pydantic_payments)
-    except Exception as e:
-        logger.error(f"Error in get_due_payments: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.get("/monthly_attendance/{student_id}/{year}/{month}", response_model=schemas.MonthlyAttendance)
-def get_monthly_attendance(student_id: str, year: int, month: int, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    attendances = db.query(models.Attendance).filter(
-        models.Attendance.student_id == student_id,
-        models.Attendance.date.between(date(year, month, 1), date(year, month + 1, 1) - timedelta(days=1))
-    ).all()
-
-    total_days = len(attendances)
-    present_days = sum(1 for a in attendances if a.present)
-
-    return schemas.MonthlyAttendance(
-        student_id=student_id,
-        month=month,
-        year=year,
-        total_days=total_days,
-        present_days=present_days
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.PROMETHEUS_MEDIA_TYPE)
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return cache.stats()
+
+@router.post("/students/", response_model=schemas.Student)
+async def create_student(student: schemas.StudentCreate, include: set = Depends(student_includes), db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.create_student, student, include)
+
+@router.get("/students/", response_model=schemas.StudentPage)
+async def get_students(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    hsc_batch: Optional[str] = None,
+    kb_batch: Optional[str] = None,
+    name: Optional[str] = Query(None, description="Name prefix"),
+    db: database.DBSession = Depends(database.get_db)
+):
+    return await db.run_sync(crud.get_students, cursor, limit, hsc_batch, kb_batch, name)
+
+# Declared before /students/{student_id}, which would otherwise match "search"
+@router.get("/students/search", response_model=List[schemas.StudentSummary])
+async def search_students(
+    q: str = Query(..., min_length=1, max_length=100, description="Words to match as prefixes of a student's id, name, phone or address"),
+    limit: int = Query(20, ge=1, le=100),
+    db: database.DBSession = Depends(database.get_db)
+):
+    return await db.run_sync(search.search_students, q, limit)
+
+@router.get("/students/{student_id}", response_model=schemas.Student)
+async def get_student(student_id: str, include: set = Depends(student_includes), db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_student, student_id, include)
+
+@router.get("/students/batch/{kb_batch}", response_model=List[schemas.Student])
+async def get_students_by_batch(kb_batch: str, include: set = Depends(student_includes), db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_students_by_batch, kb_batch, include)
+
+@router.post("/attendance/", response_model=schemas.Attendance)
+async def create_attendance(attendance: schemas.AttendanceCreate, db: database.DBSession = Depends(database.get_db)):
+    if group_commit.writer is not None:
+        return await group_commit.writer.submit(crud.add_attendance, attendance)
+    return await db.run_sync(crud.create_attendance, attendance)
+
+@router.post("/attendance/bulk", response_model=List[schemas.BulkAttendanceResult])
+async def create_bulk_attendance(roll_call: schemas.BulkAttendanceCreate, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.create_bulk_attendance, roll_call)
+
+@router.post("/payments/", response_model=schemas.PaymentHistory)
+async def create_payment(payment: schemas.PaymentHistoryCreate, db: database.DBSession = Depends(database.get_db)):
+    if group_commit.writer is not None:
+        return await group_commit.writer.submit(crud.add_payment, payment)
+    return await db.run_sync(crud.create_payment, payment)
+
+@router.get("/payments/student/{student_id}", response_model=schemas.StudentPaymentHistory)
+async def get_student_payment_history(student_id: str, response: Response, if_none_match: Optional[str] = Header(None), db: database.DBSession = Depends(database.get_db)):
+    etag = await db.run_sync(etags.student_etag, student_id, models.PaymentHistory)
+    if etag is not None and etags.matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    history = await db.run_sync(crud.get_student_payment_history, student_id, version=etag)
+    response.headers["ETag"] = etag
+    return history
+
+@router.get("/payments/year/{year}", response_model=List[schemas.PaymentHistory], response_class=fastjson.OrjsonResponse)
+async def get_yearly_payments(year: int, stream: bool = Query(False, description="Stream rows as NDJSON"), db: database.DBSession = Depends(database.get_db)):
+    if stream:
+        return await run_in_threadpool(
+            fastjson.ndjson_response, lambda session: crud.yearly_payments_query(session, year),
+            crud.PAYMENT_FIELDS, "No payments found for this year", [year]
+        )
+    return fastjson.OrjsonResponse(await db.run_sync(crud.get_yearly_payments, year))
+
+@router.get("/payments/month/{year}/{month}", response_model=schemas.MonthlyPaymentSummary)
+async def get_monthly_payments(year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_monthly_payments, year, month)
+
+@router.get("/payments/due", response_model=schemas.DuePaymentSummary, response_class=fastjson.OrjsonResponse)
+async def get_due_payments(stream: bool = Query(False, description="Stream the payments as NDJSON"), db: database.DBSession = Depends(database.get_db)):
+    if stream:
+        return await run_in_threadpool(
+            fastjson.ndjson_response, crud.due_payments_query, crud.PAYMENT_FIELDS, "No due payments found"
+        )
+    return fastjson.OrjsonResponse(await db.run_sync(crud.get_due_payments))
+
+@router.get("/dues/", response_model=schemas.DuePage)
+async def get_dues(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    year: Optional[int] = None,
+    kb_batch: Optional[str] = None,
+    db: database.DBSession = Depends(database.get_db)
+):
+    return await db.run_sync(crud.get_dues, cursor, limit, year, kb_batch)
+
+@router.get("/monthly_attendance/{student_id}/{year}/{month}", response_model=schemas.MonthlyAttendance)
+async def get_monthly_attendance(student_id: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_monthly_attendance, student_id, year, month)
+
+@router.get("/monthly_payment/{student_id}/{year}/{month}", response_model=schemas.MonthlyPayment)
+async def get_monthly_payment(student_id: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_monthly_payment, student_id, year, month)
+
+@router.get("/monthly_attendance/batch/{kb_batch}/{year}/{month}", response_model=List[schemas.MonthlyAttendance])
+async def get_batch_monthly_attendance(kb_batch: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_batch_monthly_attendance, kb_batch, year, month)
+
+@router.get("/attendance/batch/{kb_batch}/{year}", response_model=List[schemas.MonthlyAttendance])
+async def get_batch_yearly_attendance(kb_batch: str, year: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_batch_yearly_attendance, kb_batch, year)
+
+@router.get("/attendance/trend/{student_id}", response_model=List[schemas.MonthlyAttendance])
+async def get_attendance_trend(student_id: str, from_year: int, to_year: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_attendance_trend, student_id, from_year, to_year)
+
+@router.get("/attendance/trend/batch/{kb_batch}", response_model=List[schemas.BatchMonthlyAttendance])
+async def get_batch_attendance_trend(kb_batch: str, from_year: int, to_year: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_batch_attendance_trend, kb_batch, from_year, to_year)
+
+@router.get("/monthly_payment/batch/{kb_batch}/{year}/{month}", response_model=List[schemas.MonthlyPayment])
+async def get_batch_monthly_payment(kb_batch: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_batch_monthly_payment, kb_batch, year, month)
+
+@router.delete("/students/{student_id}")
+async def delete_student(student_id: str, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.delete_student, student_id)
+
+@router.delete("/attendance/{student_id}/{date}")
+async def delete_attendance(student_id: str, date: date, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.delete_attendance, student_id, date)
+
+@router.delete("/payments/{student_id}/{date}")
+async def delete_payment(student_id: str, date: date, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.delete_payment, student_id, date)
+
+@router.put("/students/{student_id}", response_model=schemas.Student)
+async def update_student(student_id: str, student: schemas.StudentCreate, include: set = Depends(student_includes), db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.update_student, student_id, student, include)
+
+@router.get("/students/{student_id}/dashboard", response_model=schemas.StudentDashboard)
+async def get_student_dashboard(
+    student_id: str,
+    limit: int = Query(10, ge=1, le=100, description="Latest payments and exams to include"),
+    since: Optional[date] = Query(None, description="Only include payments and exams from this date on"),
+    year: Optional[int] = Query(None, description="Month for attendance and exam percentage; defaults to the current one"),
+    month: Optional[int] = Query(None),
+    db: database.DBSession = Depends(database.get_db)
+):
+    today = date.today()
+    return await db.run_sync(
+        crud.get_student_dashboard, student_id, limit, since,
+        year if year is not None else today.year, month if month is not None else today.month
     )
 
-@app.get("/monthly_payment/{student_id}/{year}/{month}", response_model=schemas.MonthlyPayment)
-def get_monthly_payment(student_id: str, year: int, month: int, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
+@router.get("/students/{student_id}/yearly_dues", response_model=dict[int, float])
+async def get_student_yearly_dues(student_id: str, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_student_yearly_dues, student_id)
+
+@router.post("/exams/", response_model=schemas.ExamHistory)
+async def create_exam(exam: schemas.ExamHistoryCreate, db: database.DBSession = Depends(database.get_db)):
+    if group_commit.writer is not None:
+        return await group_commit.writer.submit(crud.add_exam, exam)
+    return await db.run_sync(crud.create_exam, exam)
+
+@router.get("/exams/student/{student_id}", response_model=schemas.StudentExamHistory)
+async def get_student_exam_history(student_id: str, response: Response, if_none_match: Optional[str] = Header(None), db: database.DBSession = Depends(database.get_db)):
+    etag = await db.run_sync(etags.student_etag, student_id, models.ExamHistory)
+    if etag is not None and etags.matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    history = await db.run_sync(crud.get_student_exam_history, student_id, version=etag)
+    response.headers["ETag"] = etag
+    return history
+
+@router.get("/exams/year/{year}", response_model=schemas.YearlyExamSummary, response_class=fastjson.OrjsonResponse)
+async def get_yearly_exams(year: int, stream: bool = Query(False, description="Stream the exams as NDJSON"), db: database.DBSession = Depends(database.get_db)):
+    if stream:
+        return await run_in_threadpool(
+            fastjson.ndjson_response, lambda session: crud.yearly_exams_query(session, year),
+            crud.EXAM_FIELDS, "No exams found for this year", [year]
+        )
+    return fastjson.OrjsonResponse(await db.run_sync(crud.get_yearly_exams, year))
+
+@router.get("/exams/month/{year}/{month}", response_model=schemas.MonthlyExamSummary)
+async def get_monthly_exams(year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_monthly_exams, year, month)
+
+@router.get("/exams/percentage/{student_id}/{year}/{month}", response_model=schemas.MonthlyExamPercentage)
+async def get_monthly_exam_percentage(student_id: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_monthly_exam_percentage, student_id, year, month)
+
+@router.get("/exams/percentage/batch/{kb_batch}/{year}/{month}", response_model=List[schemas.MonthlyExamPercentage])
+async def get_batch_monthly_exam_percentage(kb_batch: str, year: int, month: int, db: database.DBSession = Depends(database.get_db)):
+    return await db.run_sync(crud.get_batch_monthly_exam_percentage, kb_batch, year, month)
+
+@router.get("/analytics/exams/year/{year}", response_model=schemas.ExamAnalytics)
+async def get_year_exam_analytics(year: int, window: int = Query(3, ge=1, le=50), db: database.DBSession = Depends(database.get_db)):
+    from . import analytics
+    return await db.run_sync(analytics.exam_analytics, window, year=year)
+
+@router.get("/analytics/exams/{kb_batch}", response_model=schemas.ExamAnalytics)
+async def get_batch_exam_analytics(kb_batch: str, window: int = Query(3, ge=1, le=50), db: database.DBSession = Depends(database.get_db)):
+    from . import analytics
+    return await db.run_sync(analytics.exam_analytics, window, kb_batch=kb_batch)
+
+@router.get("/students/{student_id}/payment_history_excel")
+def get_student_payment_history_excel(student_id: str, if_none_match: Optional[str] = Header(None), db: Session = Depends(database.get_sync_db)):
+    from . import excel
+    etag = etags.student_etag(db, student_id, models.PaymentHistory, "xlsx")
+    if etag is None:
         raise HTTPException(status_code=404, detail="Student not found")
-
-    payments = db.query(models.PaymentHistory).filter(
-        models.PaymentHistory.student_id == student_id,
-        extract('year', models.PaymentHistory.date) == year,
-        extract('month', models.PaymentHistory.date) == month
-    ).all()
-
-    total_payment = sum(payment.payment for payment in payments)
-    total_paid = sum(payment.paid for payment in payments)
-    total_due = sum(payment.due for payment in payments)
-
-    return schemas.MonthlyPayment(
-        student_id=student_id,
-        month=month,
-        year=year,
-        total_payment=total_payment,
-        total_paid=total_paid,
-        total_due=total_due
-    )
-
-@app.delete("/students/{student_id}")
-def delete_student(student_id: str, db: Session = Depends(database.get_db)):
+    if etags.matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    db.delete(student)
-    db.commit()
-    return {"message": "Student deleted successfully"}
-
-@app.delete("/attendance/{student_id}/{date}")
-def delete_attendance(student_id: str, date: date, db: Session = Depends(database.get_db)):
-    attendance = db.query(models.Attendance).filter(
-        models.Attendance.student_id == student_id,
-        models.Attendance.date == date
-    ).first()
-    if not attendance:
-        raise HTTPException(status_code=404, detail="Attendance record not found")
-    db.delete(attendance)
-    db.commit()
-    return {"message": "Attendance record deleted successfully"}
-
-@app.delete("/payments/{student_id}/{date}")
-def delete_payment(student_id: str, date: date, db: Session = Depends(database.get_db)):
-    payment = db.query(models.PaymentHistory).filter(
-        models.PaymentHistory.student_id == student_id,
-        models.PaymentHistory.date == date
-    ).first()
-    if not payment:
-        raise HTTPException(status_code=404, detail="Payment record not found")
-    db.delete(payment)
-    db.commit()
-    return {"message": "Payment record deleted successfully"}
-
-@app.put("/students/{student_id}", response_model=schemas.Student)
-def update_student(student_id: str, student: schemas.StudentCreate, db: Session = Depends(database.get_db)):
-    db_student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if db_student is None:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    for key, value in student.dict().items():
-        setattr(db_student, key, value)
-    
-    db.commit()
-    db.refresh(db_student)
-    return db_student
-
-@app.get("/students/{student_id}/yearly_dues", response_model=dict[int, float])
-def get_student_yearly_dues(student_id: str, db: Session = Depends(database.get_db)):
-    try:
-        student = db.query(models.Student).filter(models.Student.id == student_id).first()
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found")
-        
-        yearly_dues = db.query(
-            extract('year', models.PaymentHistory.date).label('year'),
-            func.sum(models.PaymentHistory.due).label('total_due')
-        ).filter(
-            models.PaymentHistory.student_id == student_id
-        ).group_by(
-            extract('year', models.PaymentHistory.date)
-        ).all()
-        
-        dues_dict = {year: float(total_due) for year, total_due in yearly_dues}
-        return dues_dict
-    except Exception as e:
-        logger.error(f"Error in get_student_yearly_dues: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.post("/exams/", response_model=schemas.ExamHistory)
-def create_exam(exam: schemas.ExamHistoryCreate, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == exam.student_id).first()
-    if not student:
+
+    # Archived years are merged in by date
+    payments = archive.merged_rows(db, lambda session: session.query(
+        models.PaymentHistory.date,
+        models.PaymentHistory.payment,
+        models.PaymentHistory.paid,
+        models.PaymentHistory.due,
+        models.PaymentHistory.total_subjects
+    ).filter(models.PaymentHistory.student_id == student_id).order_by(models.PaymentHistory.date), key=lambda row: row.date)
+
+    wb = excel.new_workbook()
+    excel.write_payment_history(wb, student.id, student.name, payments)
+    response = excel.xlsx_response(excel.save_workbook(wb), f"payment_history_{student_id}.xlsx")
+    response.headers["ETag"] = etag
+    return response
+
+@router.get("/students/{student_id}/exam_history_excel")
+def get_student_exam_history_excel(student_id: str, if_none_match: Optional[str] = Header(None), db: Session = Depends(database.get_sync_db)):
+    from . import excel
+    etag = etags.student_etag(db, student_id, models.ExamHistory, "xlsx")
+    if etag is None:
         raise HTTPException(status_code=404, detail="Student not found")
-    
-    db_exam = models.ExamHistory(**exam.dict())
-    db.add(db_exam)
-    db.commit()
-    db.refresh(db_exam)
-    return db_exam
-
-@app.get("/exams/student/{student_id}", response_model=schemas.StudentExamHistory)
-def get_student_exam_history(student_id: str, db: Session = Depends(database.get_db)):
-    try:
-        student = db.query(models.Student).filter(models.Student.id == student_id).first()
-        if not student:
-            raise HTTPException(status_code=404, detail="Student not found")
-        
-        exams = db.query(models.ExamHistory).filter(models.ExamHistory.student_id == student_id).all()
-        return schemas.StudentExamHistory(student_id=student_id, exams=exams)
-    except Exception as e:
-        logger.error(f"Error in get_student_exam_history: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-
-@app.get("/exams/year/{year}", response_model=schemas.YearlyExamSummary)
-def get_yearly_exams(year: int, db: Session = Depends(database.get_db)):
-    exams = db.query(models.ExamHistory).filter(extract('year', models.ExamHistory.date) == year).all()
-    if not exams:
-        raise HTTPException(status_code=404, detail="No exams found for this year")
-    return schemas.YearlyExamSummary(year=year, exams=exams)
-
-@app.get("/exams/month/{year}/{month}", response_model=schemas.MonthlyExamSummary)
-def get_monthly_exams(year: int, month: int, db: Session = Depends(database.get_db)):
-    exams = db.query(models.ExamHistory).filter(
-        extract('year', models.ExamHistory.date) == year,
-        extract('month', models.ExamHistory.date) == month
-    ).all()
-    if not exams:
-        raise HTTPException(status_code=404, detail="No exams found for this month")
-    return schemas.MonthlyExamSummary(year=year, month=month, exams=exams)
-
-@app.get("/exams/percentage/{student_id}/{year}/{month}", response_model=schemas.MonthlyExamPercentage)
-def get_monthly_exam_percentage(student_id: str, year: int, month: int, db: Session = Depends(database.get_db)):
+    if etags.matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
     student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-
-    exams = db.query(models.ExamHistory).filter(
-        models.ExamHistory.student_id == student_id,
-        extract('year', models.ExamHistory.date) == year,
-        extract('month', models.ExamHistory.date) == month
-    ).all()
-
-    if not exams:
-        raise HTTPException(status_code=404, detail="No exams found for this student in the specified month")
-
-    total_marks = sum(exam.total_marks for exam in exams)
-    obtained_marks = sum(exam.obtained_marks for exam in exams)
-    percentage = (obtained_marks / total_marks) * 100 if total_marks > 0 else 0
 
-    return schemas.MonthlyExamPercentage(
-        student_id=student_id,
-        year=year,
-        month=month,
-        percentage=round(percentage, 2)
-    )
+    exams = archive.merged_rows(db, lambda session: session.query(
+        models.ExamHistory.date,
+        models.ExamHistory.subject_name,
+        models.ExamHistory.total_marks,
+        models.ExamHistory.obtained_marks
+    ).filter(models.ExamHistory.student_id == student_id).order_by(models.ExamHistory.date), key=lambda row: row.date)
+
+    wb = excel.new_workbook()
+    excel.write_exam_history(wb, student.id, student.name, exams)
+    response = excel.xlsx_response(excel.save_workbook(wb), f"exam_history_{student_id}.xlsx")
+    response.headers["ETag"] = etag
+    return response
+
+@router.get("/reports/batch/{kb_batch}/excel")
+async def get_batch_report_excel(kb_batch: str, db: Session = Depends(database.get_sync_db)):
+    from . import excel
+    students = await run_in_threadpool(reports.load_report_data, db, kb_batch)
+    if not students:
+        raise HTTPException(status_code=404, detail="No students found for this batch")
 
-@app.get("/students/{student_id}/payment_history_excel")
-def get_student_payment_history_excel(student_id: str, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
+    loop = asyncio.get_running_loop()
+    path = await loop.run_in_executor(reports.get_pool(), reports.render_batch_report, kb_batch, students)
+    return excel.xlsx_response(path, f"batch_report_{kb_batch}.xlsx")
 
-    payments = db.query(models.PaymentHistory).filter(models.PaymentHistory.student_id == student_id).all()
-
-    # Create a new workbook and select the active sheet
-    wb = openpyxl.Workbook()
-    sheet = wb.active
-    sheet.title = "Payment History"
-
-    # Add student information
-    sheet.merge_cells('A1:E1')
-    sheet['A1'] = f"Payment History for {student.name} (ID: {student.id})"
-    sheet['A1'].font = Font(size=16, bold=True)
-    sheet['A1'].alignment = Alignment(horizontal='center', vertical='center')
-
-    # Add headers
-    headers = ["Date", "Payment", "Paid", "Due", "Total Subjects"]
-    for col, header in enumerate(headers, start=1):
-        cell = sheet.cell(row=3, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    # Add payment data and calculate totals
-    total_payment = 0
-    total_paid = 0
-    total_due = 0
-    for row, payment in enumerate(payments, start=4):
-        sheet.cell(row=row, column=1, value=payment.date).alignment = Alignment(horizontal='center')
-        sheet.cell(row=row, column=2, value=payment.payment).alignment = Alignment(horizontal='right')
-        sheet.cell(row=row, column=3, value=payment.paid).alignment = Alignment(horizontal='right')
-        due_cell = sheet.cell(row=row, column=4, value=payment.due)
-        due_cell.alignment = Alignment(horizontal='right')
-        if payment.due > 0:
-            due_cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-            due_cell.font = Font(color="9C0006")
-        else:
-            due_cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-            due_cell.font = Font(color="006100")
-        sheet.cell(row=row, column=5, value=payment.total_subjects).alignment = Alignment(horizontal='center')
-        
-        total_payment += payment.payment
-        total_paid += payment.paid
-        total_due += payment.due
-
-    # Apply borders
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    for row in sheet['A3:E' + str(sheet.max_row)]:
-        for cell in row:
-            cell.border = thin_border
-
-    # Adjust column widths
-    for col in range(1, 6):
-        sheet.column_dimensions[get_column_letter(col)].width = 15
-
-    # Add total row
-    total_row = sheet.max_row + 2
-    sheet.cell(row=total_row, column=1, value="Total").font = Font(bold=True)
-    sheet.cell(row=total_row, column=2, value=total_payment).font = Font(bold=True)
-    sheet.cell(row=total_row, column=3, value=total_paid).font = Font(bold=True)
-    sheet.cell(row=total_row, column=4, value=total_due).font = Font(bold=True)
-
-    # Create a temporary file to save the Excel sheet
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        wb.save(tmp.name)
-        tmp_path = tmp.name
-
-    # Return the file as a downloadable response
-    return FileResponse(
-        tmp_path,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=f"payment_history_{student_id}.xlsx"
-    )
-
-@app.get("/students/{student_id}/exam_history_excel")
-def get_student_exam_history_excel(student_id: str, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.id == student_id).first()
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
+@router.get("/reports/institution/excel")
+async def get_institution_report_excel(db: Session = Depends(database.get_sync_db)):
+    from . import excel
+    students = await run_in_threadpool(reports.load_institution_data, db)
+    if not students:
+        raise HTTPException(status_code=404, detail="No students found")
+
+    loop = asyncio.get_running_loop()
+    path = await loop.run_in_executor(reports.get_pool(), reports.render_institution_report, students)
+    return excel.xlsx_response(path, "institution_report.xlsx")
+
+@router.post("/import/{kind}", response_model=schemas.ImportReport)
+async def import_records(
+    kind: Literal["students", "payments", "exams"],
+    file: UploadFile = File(..., description="CSV or XLSX file with a header row of field names"),
+    db: Session = Depends(database.get_sync_db)
+):
+    try:
+        # Opening checks the whole file, so it runs off the event loop too
+        rows = await run_in_threadpool(importer.iter_file_rows, file.file, file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await run_in_threadpool(importer.import_rows, db, kind, rows)
 
-    exams = db.query(models.ExamHistory).filter(models.ExamHistory.student_id == student_id).order_by(models.ExamHistory.date).all()
-
-    # Create a new workbook and select the active sheet
-    wb = openpyxl.Workbook()
-    sheet = wb.active
-    sheet.title = "Exam History"
-
-    # Add student information
-    sheet.merge_cells('A1:E1')
-    sheet['A1'] = f"Exam History for {student.name} (ID: {student.id})"
-    sheet['A1'].font = Font(size=16, bold=True)
-    sheet['A1'].alignment = Alignment(horizontal='center', vertical='center')
-
-    # Add headers
-    headers = ["Date", "Subject", "Total Marks", "Obtained Marks", "Percentage"]
-    for col, header in enumerate(headers, start=1):
-        cell = sheet.cell(row=3, column=col, value=header)
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    # Add exam data
-    for row, exam in enumerate(exams, start=4):
-        sheet.cell(row=row, column=1, value=exam.date).alignment = Alignment(horizontal='center')
-        sheet.cell(row=row, column=2, value=exam.subject_name).alignment = Alignment(horizontal='left')
-        sheet.cell(row=row, column=3, value=exam.total_marks).alignment = Alignment(horizontal='right')
-        sheet.cell(row=row, column=4, value=exam.obtained_marks).alignment = Alignment(horizontal='right')
-        percentage = (exam.obtained_marks / exam.total_marks) * 100 if exam.total_marks > 0 else 0
-        sheet.cell(row=row, column=5, value=round(percentage, 2)).alignment = Alignment(horizontal='right')
-
-    # Apply borders
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    for row in sheet['A3:E' + str(sheet.max_row)]:
-        for cell in row:
-            cell.border = thin_border
-
-    # Adjust column widths
-    for col in range(1, 6):
-        sheet.column_dimensions[get_column_letter(col)].width = 15
-
-    # Create a line chart
-    chart = LineChart()
-    chart.title = "Exam Performance Over Time"
-    chart.y_axis.title = "Percentage"
-    chart.x_axis.title = "Exams"
-
-    # Add data to the chart
-    data = Reference(sheet, min_col=5, min_row=3, max_row=sheet.max_row, max_col=5)
-    chart.add_data(data, titles_from_data=True)
-
-    # Set categories (x-axis labels) to exam dates
-    dates = Reference(sheet, min_col=1, min_row=4, max_row=sheet.max_row)
-    chart.set_categories(dates)
-
-    # Add the chart to the sheet
-    sheet.add_chart(chart, "G3")
-
-    # Create a temporary file to save the Excel sheet
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        wb.save(tmp.name)
-        tmp_path = tmp.name
-
-    # Return the file as a downloadable response
-    return FileResponse(
-        tmp_path,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        filename=f"exam_history_{student_id}.xlsx"
-    )
\ No newline at end of file
+app = create_app()
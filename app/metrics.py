@@ -0,0 +1,285 @@
+"""Request timing, SQL query profiling and Prometheus metrics.
+
+MetricsMiddleware times every request and records it in a latency histogram
+labelled by method, route template and status. SQL statements are timed by
+cursor event hooks on the engines (instrument()); each one is added to the
+request that issued it, found through a context variable that follows the
+request into the threadpool, and statements slower than KB_SLOW_QUERY_MS are
+logged with their parameters. Each response carries a Server-Timing header
+with the request's total and SQL time, and GET /metrics renders everything in
+the Prometheus text format.
+
+With KB_PROFILING=1 (development only) a request with `?profile=1` is run
+under cProfile and the stats are written to KB_PROFILE_DIR; the file name is
+returned in an X-Profile header. The profiler covers the event loop thread
+and the session's threadpool calls, and on the event loop it also sees any
+other request running at the same time. Only one request is profiled at a
+time: from Python 3.12 a single profiler may be active per process (and it
+sees every thread), so a `?profile=1` request arriving while another is being
+profiled runs unprofiled, with `X-Profile: busy`.
+"""
+import cProfile
+import contextvars
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+SLOW_QUERY_SECONDS = float(os.getenv("KB_SLOW_QUERY_MS", "100")) / 1000
+PROFILING = os.getenv("KB_PROFILING", "0") == "1"
+PROFILE_DIR = os.getenv("KB_PROFILE_DIR", "profiles")
+# From 3.12 cProfile runs on sys.monitoring: one profiler per process, covering
+# every thread. Before that a profiler only sees the thread that enabled it.
+PROFILER_SEES_ALL_THREADS = sys.version_info >= (3, 12)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+class RequestStats:
+    """SQL work done on behalf of one request, possibly from several threads."""
+
+    def __init__(self, profiler=None):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.profiler = profiler
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.sql_seconds += seconds
+
+current = contextvars.ContextVar("kb_request_stats", default=None)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{format_labels(labels, le=bound)} {cumulative}"
+        yield f"{name}_sum{format_labels(labels)} {self.total}"
+        yield f"{name}_count{format_labels(labels)} {cumulative}"
+
+class Registry:
+    """Process-wide request and SQL metrics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (method, route, status)
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))    # (method, route)
+            self.sql_seconds = defaultdict(float)                           # (method, route)
+            self.slow_queries = 0
+            self.unattributed_queries = 0
+            self.unattributed_sql_seconds = 0.0
+
+    def record_request(self, method, route, status, seconds, stats):
+        with self.lock:
+            self.latency[method, route, str(status)].observe(seconds)
+            self.queries[method, route].observe(stats.queries)
+            self.sql_seconds[method, route] += stats.sql_seconds
+
+    def record_query(self, seconds, slow):
+        with self.lock:
+            if slow:
+                self.slow_queries += 1
+            if current.get() is None:
+                # Startup work, CLI commands and the like
+                self.unattributed_queries += 1
+                self.unattributed_sql_seconds += seconds
+
+    def render(self):
+        with self.lock:
+            lines = [
+                "# HELP kb_http_request_duration_seconds Request latency by route.",
+                "# TYPE kb_http_request_duration_seconds histogram",
+            ]
+            for (method, route, status), histogram in sorted(self.latency.items()):
+                lines.extend(histogram.samples("kb_http_request_duration_seconds", {"method": method, "route": route, "status": status}))
+            lines += [
+                "# HELP kb_db_queries_per_request SQL statements executed per request by route.",
+                "# TYPE kb_db_queries_per_request histogram",
+            ]
+            for (method, route), histogram in sorted(self.queries.items()):
+                lines.extend(histogram.samples("kb_db_queries_per_request", {"method": method, "route": route}))
+            lines += [
+                "# HELP kb_db_query_seconds_total Time spent executing SQL by route.",
+                "# TYPE kb_db_query_seconds_total counter",
+            ]
+            for (method, route), seconds in sorted(self.sql_seconds.items()):
+                lines.append(f"kb_db_query_seconds_total{format_labels({'method': method, 'route': route})} {seconds}")
+            lines += [
+                "# HELP kb_db_slow_queries_total SQL statements slower than KB_SLOW_QUERY_MS.",
+                "# TYPE kb_db_slow_queries_total counter",
+                f"kb_db_slow_queries_total {self.slow_queries}",
+                "# HELP kb_db_unattributed_queries_total SQL statements executed outside a request.",
+                "# TYPE kb_db_unattributed_queries_total counter",
+                f"kb_db_unattributed_queries_total {self.unattributed_queries}",
+                "# HELP kb_db_unattributed_query_seconds_total Time spent on SQL outside a request.",
+                "# TYPE kb_db_unattributed_query_seconds_total counter",
+                f"kb_db_unattributed_query_seconds_total {self.unattributed_sql_seconds}",
+            ]
+            return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def format_labels(labels, **extra):
+    labels = {**labels, **{name: str(value) for name, value in extra.items()}}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render():
+    return registry.render()
+
+# SQL hooks
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("kb_query_started", []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["kb_query_started"].pop()
+    stats = current.get()
+    if stats is not None:
+        stats.add_query(elapsed)
+    slow = elapsed >= SLOW_QUERY_SECONDS
+    registry.record_query(elapsed, slow)
+    if slow:
+        if executemany:
+            parameters = f"{len(parameters)} parameter sets, first {parameters[:1]!r}"
+        logger.warning("Slow query (%.1f ms): %s %s", elapsed * 1000, " ".join(statement.split()), parameters)
+
+def handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    started = context.connection.info.get("kb_query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+def instrument(engine):
+    """Time every statement run on `engine` (a sync Engine, or an AsyncEngine's sync_engine)."""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+# Profiling
+
+profiling = threading.Lock()
+
+def profiled(fn):
+    """Wrap a function about to run in a worker thread so the current request's
+    profiler, if any, covers it too."""
+    stats = current.get()
+    if stats is None or stats.profiler is None or PROFILER_SEES_ALL_THREADS:
+        return fn
+
+    def run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            with stats.lock:
+                stats.thread_profiles.append(profiler)
+    return run
+
+def dump_profile(stats, method, path):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", f"{method} {path}").strip("_")
+    filename = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{name}.prof")
+    combined = pstats.Stats(stats.profiler)
+    for profiler in stats.thread_profiles:
+        combined.add(profiler)
+    combined.dump_stats(filename)
+    return filename
+
+def wants_profile(scope):
+    if not PROFILING:
+        return False
+    return parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile") == ["1"]
+
+# Middleware
+
+def server_timing(total, stats):
+    return (
+        f"app;dur={total * 1000:.1f}, "
+        f'db;dur={stats.sql_seconds * 1000:.1f};desc="{stats.queries} queries"'
+    )
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        wanted = wants_profile(scope)
+        stats = RequestStats(cProfile.Profile() if wanted and profiling.acquire(blocking=False) else None)
+        token = current.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                if stats.profiler is not None:
+                    stats.profiler.disable()
+                    headers["X-Profile"] = os.path.basename(dump_profile(stats, scope["method"], scope["path"]))
+                elif wanted:
+                    headers["X-Profile"] = "busy"
+                headers.append("Server-Timing", server_timing(time.perf_counter() - started, stats))
+            await send(message)
+
+        if stats.profiler is not None:
+            try:
+                stats.profiler.enable()
+            except ValueError as e:
+                # Another tool (a debugger, coverage) holds the profiling hook
+                logger.warning("Can't profile %s %s: %s", scope["method"], scope["path"], e)
+                stats.profiler = None
+                profiling.release()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if stats.profiler is not None:
+                stats.profiler.disable()
+                profiling.release()
+            current.reset(token)
+            route = scope.get("route")
+            registry.record_request(
+                scope["method"], route.path if route is not None else "unmatched",
+                status, time.perf_counter() - started, stats
+            )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Date, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Date, Float, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -18,6 +18,26 @@ class Student(Base):
     payment_history = relationship("PaymentHistory", back_populates="student")
     exam_history = relationship("ExamHistory", back_populates="student")
 
+    # Batch filters followed by id, so filtered listings can page by id without sorting
+    __table_args__ = (
+        Index("ix_students_kb_batch_id", "kb_batch", "id"),
+        Index("ix_students_hsc_batch_id", "hsc_batch", "id"),
+    )
+
+class StudentVersion(Base):
+    """Per-student change counter, bumped by every write; see app.etags."""
+    __tablename__ = "student_versions"
+
+    student_id = Column(String, ForeignKey("students.id"), primary_key=True)
+    version = Column(Integer, nullable=False)
+
+class StudentIdSequence(Base):
+    """Last student number handed out for each HSC batch."""
+    __tablename__ = "student_id_sequences"
+
+    hsc_batch = Column(String, primary_key=True)
+    last_value = Column(Integer, nullable=False)
+
 class Attendance(Base):
     __tablename__ = "attendances"
 
@@ -28,6 +48,21 @@ class Attendance(Base):
 
     student = relationship("Student", back_populates="attendances")
 
+    # One record per student per day; the bulk roll-call upsert targets this index
+    __table_args__ = (
+        Index("ix_attendances_student_id_date", "student_id", "date", unique=True),
+    )
+
+class AttendanceMonthly(Base):
+    """Recorded and present days per student per month, maintained by app.rollups."""
+    __tablename__ = "attendance_monthly"
+
+    student_id = Column(String, ForeignKey("students.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    total_days = Column(Integer, nullable=False)
+    present_days = Column(Integer, nullable=False)
+
 class PaymentHistory(Base):
     __tablename__ = "payment_history"
 
@@ -41,6 +76,27 @@ class PaymentHistory(Base):
 
     student = relationship("Student", back_populates="payment_history")
 
+    __table_args__ = (
+        Index("ix_payment_history_student_id_date", "student_id", "date"),
+        Index("ix_payment_history_date", "date"),
+        # Only outstanding payments, for the due listing
+        Index("ix_payment_history_outstanding", "student_id", "date",
+              sqlite_where=text("due > 0"), postgresql_where=text("due > 0")),
+    )
+
+class DuesLedger(Base):
+    """SUM(due) and payment count per student per year, maintained by app.ledger."""
+    __tablename__ = "dues_ledger"
+
+    student_id = Column(String, ForeignKey("students.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    total_due = Column(Float, nullable=False)
+    payment_count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_dues_ledger_year_total_due", "year", "total_due"),
+    )
+
 class ExamHistory(Base):
     __tablename__ = "exam_history"
 
@@ -52,3 +108,8 @@ class ExamHistory(Base):
     obtained_marks = Column(Float, nullable=False)
 
     student = relationship("Student", back_populates="exam_history")
+
+    __table_args__ = (
+        Index("ix_exam_history_student_id_date", "student_id", "date"),
+        Index("ix_exam_history_date", "date"),
+    )
@@ -0,0 +1,25 @@
+from datetime import date
+from typing import Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_
+
+def period_bounds(year: int, month: Optional[int] = None) -> Tuple[date, date]:
+    """Return the half-open [start, end) date range covering a year, or one month of it."""
+    if not 1 <= year < 9999:
+        raise HTTPException(status_code=400, detail="Year must be between 1 and 9998")
+    if month is None:
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Month must be between 1 and 12")
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+def in_period(column, year: int, month: Optional[int] = None):
+    """Filter clause for `column` falling in the given year/month.
+
+    Comparing the bare column against a range (rather than extract()-ing the year
+    and month from every row) lets SQLite answer the filter from an index.
+    """
+    start, end = period_bounds(year, month)
+    return and_(column >= start, column < end)
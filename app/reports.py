@@ -0,0 +1,174 @@
+"""Batch-wide and institution-wide Excel reports.
+
+Report data is read from the database in the API process and handed to a
+process pool as plain tuples; rendering the workbook (the CPU-heavy part) runs
+in a worker process so it doesn't hold the event loop or a request thread.
+Only the rendering functions import app.excel, and with it openpyxl.
+"""
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from . import models
+
+REPORT_WORKERS = int(os.getenv("KB_REPORT_WORKERS", "0")) or None  # None: one per CPU
+
+SUMMARY_HEADERS = ["Student ID", "Name", "KB Batch", "Total Payment", "Total Paid", "Total Due", "Exams", "Exam %"]
+BATCH_HEADERS = ["KB Batch", "Students", "Total Payment", "Total Paid", "Total Due", "Exam %"]
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS)
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def load_report_data(db: Session, kb_batch=None, with_payments=True):
+    """Collect everything a report needs as picklable tuples.
+
+    Returns a list of (student_id, name, kb_batch, exam_totals, payments) where
+    exam_totals is (exam_count, total_marks, obtained_marks) and payments is a
+    list of (date, payment, paid, due, total_subjects) rows in date order (empty
+    when `with_payments` is false).
+    """
+    students = db.query(models.Student.id, models.Student.name, models.Student.kb_batch)
+    if kb_batch is not None:
+        students = students.filter(models.Student.kb_batch == kb_batch)
+    students = students.order_by(models.Student.id).all()
+    if not students:
+        return []
+
+    exams = db.query(
+        models.ExamHistory.student_id,
+        func.count(models.ExamHistory.id),
+        func.sum(models.ExamHistory.total_marks),
+        func.sum(models.ExamHistory.obtained_marks)
+    )
+    if kb_batch is not None:
+        exams = exams.join(models.Student).filter(models.Student.kb_batch == kb_batch)
+    exam_totals = {row[0]: tuple(row[1:]) for row in exams.group_by(models.ExamHistory.student_id)}
+
+    payments = defaultdict(list)
+    if with_payments:
+        rows = db.query(
+            models.PaymentHistory.student_id,
+            models.PaymentHistory.date,
+            models.PaymentHistory.payment,
+            models.PaymentHistory.paid,
+            models.PaymentHistory.due,
+            models.PaymentHistory.total_subjects
+        )
+        if kb_batch is not None:
+            rows = rows.join(models.Student).filter(models.Student.kb_batch == kb_batch)
+        for row in rows.order_by(models.PaymentHistory.student_id, models.PaymentHistory.date).yield_per(5000):
+            payments[row[0]].append(tuple(row[1:]))
+
+    return [
+        (student_id, name, batch, exam_totals.get(student_id, (0, 0, 0)), payments.get(student_id, []))
+        for student_id, name, batch in students
+    ]
+
+def load_institution_data(db: Session):
+    """Student rows with payment sums computed by the database."""
+    sums = {
+        student_id: (total_payment, total_paid, total_due)
+        for student_id, total_payment, total_paid, total_due in db.query(
+            models.PaymentHistory.student_id,
+            func.sum(models.PaymentHistory.payment),
+            func.sum(models.PaymentHistory.paid),
+            func.sum(models.PaymentHistory.due)
+        ).group_by(models.PaymentHistory.student_id)
+    }
+    return [
+        (student_id, name, batch, exams, sums.get(student_id, (0, 0, 0)))
+        for student_id, name, batch, exams, _ in load_report_data(db, with_payments=False)
+    ]
+
+def sheet_title(name, used):
+    # Excel limits sheet names to 31 characters and forbids []:*?/\
+    title = re.sub(r"[\[\]:*?/\\]", "_", name)[:31]
+    candidate, n = title, 1
+    while candidate.lower() in used:
+        n += 1
+        suffix = f" ({n})"
+        candidate = title[:31 - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+def payment_sums(payments):
+    total_payment = total_paid = total_due = 0
+    for _, payment, paid, due, _ in payments:
+        total_payment += payment
+        total_paid += paid
+        total_due += due
+    return total_payment, total_paid, total_due
+
+def write_summary_rows(sheet, rows):
+    from . import excel
+    for student_id, name, batch, (exam_count, total_marks, obtained_marks), sums in rows:
+        due = sums[2]
+        sheet.append([
+            excel.styled(sheet, student_id, "kb_left"),
+            excel.styled(sheet, name, "kb_left"),
+            excel.styled(sheet, batch, "kb_left"),
+            excel.styled(sheet, sums[0], "kb_right"),
+            excel.styled(sheet, sums[1], "kb_right"),
+            excel.styled(sheet, due, "kb_due" if due > 0 else "kb_cleared"),
+            excel.styled(sheet, exam_count, "kb_center"),
+            excel.styled(sheet, excel.percentage(total_marks, obtained_marks), "kb_right"),
+        ])
+
+def render_batch_report(kb_batch, students):
+    """Worker entry point: a summary sheet plus one payment sheet per student."""
+    from . import excel
+    wb = excel.new_workbook()
+    used = {"summary"}
+    summary = excel.start_sheet(wb, "Summary", f"Batch Report for {kb_batch}", SUMMARY_HEADERS)
+    write_summary_rows(summary, (
+        (student_id, name, batch, exams, payment_sums(payments))
+        for student_id, name, batch, exams, payments in students
+    ))
+    for student_id, name, _, _, payments in students:
+        excel.write_payment_history(wb, student_id, name, payments, title=sheet_title(student_id, used))
+    return excel.save_workbook(wb)
+
+def render_institution_report(students):
+    """Worker entry point: per-batch totals and every student's summary row.
+
+    `students` comes from load_institution_data(), which has the payment sums
+    already folded in, so no per-row history crosses the pool.
+    """
+    from . import excel
+    batches = defaultdict(lambda: [0, 0, 0, 0, 0, 0])
+    for _, _, batch, (_, total_marks, obtained_marks), (payment, paid, due) in students:
+        totals = batches[batch or ""]
+        totals[0] += 1
+        totals[1] += payment
+        totals[2] += paid
+        totals[3] += due
+        totals[4] += total_marks or 0
+        totals[5] += obtained_marks or 0
+
+    wb = excel.new_workbook()
+    sheet = excel.start_sheet(wb, "Batches", "Institution Report", BATCH_HEADERS)
+    for batch, (count, payment, paid, due, total_marks, obtained_marks) in sorted(batches.items()):
+        sheet.append([
+            excel.styled(sheet, batch, "kb_left"),
+            excel.styled(sheet, count, "kb_center"),
+            excel.styled(sheet, payment, "kb_right"),
+            excel.styled(sheet, paid, "kb_right"),
+            excel.styled(sheet, due, "kb_due" if due > 0 else "kb_cleared"),
+            excel.styled(sheet, excel.percentage(total_marks, obtained_marks), "kb_right"),
+        ])
+    students_sheet = excel.start_sheet(wb, "Students", "All Students", SUMMARY_HEADERS)
+    write_summary_rows(students_sheet, students)
+    return excel.save_workbook(wb)
@@ -0,0 +1,116 @@
+"""Monthly attendance rollups.
+
+The attendance_monthly table holds the number of recorded days and present
+days for every (student, year, month) with attendance. create_attendance,
+the roll-call upsert and delete_attendance update it in the same transaction
+as the attendance rows, so monthly and batch attendance read a handful of
+rollup rows instead of counting every class day.
+
+Batch figures are summed from the student rollups of the batch's current
+members at query time, so moving a student to another kb_batch needs no
+rollup maintenance.
+
+Years moved to the archive (app.archive) keep their rollups; check and
+rebuild leave them alone. Rows written behind the API's back leave the rollups
+stale; check and rebuild them with
+
+    python -m app.rollups check
+    python -m app.rollups rebuild
+"""
+import sys
+from collections import defaultdict
+from sqlalchemy import extract, func, case
+from sqlalchemy.orm import Session
+from . import models, database, archive
+
+def record_attendance(db: Session, changes):
+    """Apply attendance changes to the rollups.
+
+    `changes` are (student_id, date, days_delta, present_delta) tuples: +1/+1
+    for a new present mark, 0/-1 for a present mark changed to absent, -1/0
+    for a deleted absent mark, and so on.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for student_id, day, days_delta, present_delta in changes:
+        delta = deltas[(student_id, day.year, day.month)]
+        delta[0] += days_delta
+        delta[1] += present_delta
+    deltas = {key: delta for key, delta in deltas.items() if delta != [0, 0]}
+    if not deltas:
+        return
+
+    table = models.AttendanceMonthly.__table__
+    stmt = database.backend.insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.student_id, table.c.year, table.c.month],
+        set_={
+            "total_days": table.c.total_days + stmt.excluded.total_days,
+            "present_days": table.c.present_days + stmt.excluded.present_days,
+        },
+    )
+    db.execute(stmt, [
+        {"student_id": student_id, "year": year, "month": month, "total_days": days, "present_days": present}
+        for (student_id, year, month), (days, present) in deltas.items()
+    ])
+    if any(days < 0 for days, _ in deltas.values()):
+        # A month with no attendance left has no row, as after a rebuild
+        db.query(models.AttendanceMonthly).filter(
+            models.AttendanceMonthly.student_id.in_({student_id for student_id, _, _ in deltas}),
+            models.AttendanceMonthly.total_days <= 0
+        ).delete(synchronize_session=False)
+
+def computed_rollups(db: Session, archived=()):
+    """The rollups as aggregated from attendances, except for `archived` years."""
+    year = extract("year", models.Attendance.date)
+    month = extract("month", models.Attendance.date)
+    return db.query(
+        models.Attendance.student_id,
+        year,
+        month,
+        func.count(models.Attendance.id),
+        func.sum(case((models.Attendance.present, 1), else_=0))
+    ).filter(
+        models.Attendance.student_id.isnot(None),
+        year.notin_(archived)
+    ).group_by(models.Attendance.student_id, year, month)
+
+def rebuild(db: Session):
+    """Replace the rollups of unarchived years with ones aggregated from attendances. Commit is left to the caller."""
+    archived = archive.archived_years()
+    db.query(models.AttendanceMonthly).filter(models.AttendanceMonthly.year.notin_(archived)).delete(synchronize_session=False)
+    db.execute(
+        models.AttendanceMonthly.__table__.insert().from_select(
+            ["student_id", "year", "month", "total_days", "present_days"], computed_rollups(db, archived)
+        )
+    )
+
+def check(db: Session):
+    """Compare the rollups with attendances and return a list of mismatch descriptions."""
+    archived = archive.archived_years()
+    expected = {
+        (student_id, int(year), int(month)): (total_days, present_days)
+        for student_id, year, month, total_days, present_days in computed_rollups(db, archived)
+    }
+    actual = {
+        (row.student_id, row.year, row.month): (row.total_days, row.present_days)
+        for row in db.query(models.AttendanceMonthly).filter(models.AttendanceMonthly.year.notin_(archived))
+    }
+    problems = []
+    for key in sorted(expected.keys() | actual.keys()):
+        label = f"{key[0]} {key[1]}-{key[2]:02d}"
+        if key not in actual:
+            problems.append(f"{label}: missing from rollups")
+        elif key not in expected:
+            problems.append(f"{label}: in rollups but no attendance")
+        elif expected[key] != actual[key]:
+            problems.append(
+                f"{label}: rollup has {actual[key][1]}/{actual[key][0]} days present, "
+                f"attendances have {expected[key][1]}/{expected[key][0]}"
+            )
+    return problems
+
+def main(argv):
+    return database.derived_table_main(argv, check, rebuild, "Attendance rollups")
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import date
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class StudentBase(BaseModel):
     name: str
@@ -47,12 +47,24 @@ class ExamHistory(ExamHistoryBase):
 
 class Student(StudentBase):
     id: str
-    payment_history: List[PaymentHistory] = []
-    exam_history: List[ExamHistory] = []
+    # Only populated when requested with ?include=payments,exams
+    payment_history: Optional[List[PaymentHistory]] = None
+    exam_history: Optional[List[ExamHistory]] = None
 
     class Config:
         from_attributes = True  # This replaces orm_mode = True
 
+class StudentSummary(StudentBase):
+    id: str
+
+    class Config:
+        from_attributes = True
+
+class StudentPage(BaseModel):
+    students: List[StudentSummary]
+    # Pass as `cursor` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
 class AttendanceCreate(BaseModel):
     student_id: str
     date: date
@@ -64,6 +76,19 @@ class Attendance(AttendanceCreate):
     class Config:
         from_attributes = True  # This replaces orm_mode = True
 
+class RollCallEntry(BaseModel):
+    student_id: str
+    present: bool
+
+class BulkAttendanceCreate(BaseModel):
+    date: date
+    records: List[RollCallEntry]
+
+class BulkAttendanceResult(BaseModel):
+    student_id: str
+    status: str  # "created", "updated" or "not_found"
+    attendance: Optional[Attendance] = None
+
 class MonthlyAttendance(BaseModel):
     student_id: str
     month: int
@@ -71,6 +96,19 @@ class MonthlyAttendance(BaseModel):
     total_days: int
     present_days: int
 
+    class Config:
+        from_attributes = True
+
+class BatchMonthlyAttendance(BaseModel):
+    kb_batch: str
+    year: int
+    month: int
+    # Students with attendance recorded in the month
+    students: int
+    total_days: int
+    present_days: int
+    percentage: float
+
 class MonthlyPayment(BaseModel):
     student_id: str
     month: int
@@ -91,6 +129,17 @@ class MonthlyPaymentSummary(BaseModel):
 class DuePaymentSummary(BaseModel):
     payments: List[PaymentHistory]
 
+class StudentDue(BaseModel):
+    student_id: str
+    name: str
+    kb_batch: Optional[str] = None
+    total_due: float
+
+class DuePage(BaseModel):
+    students: List[StudentDue]
+    # Pass as `cursor` to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
 class StudentExamHistory(BaseModel):
     student_id: str
     exams: List[ExamHistory]
@@ -109,3 +158,53 @@ class MonthlyExamPercentage(BaseModel):
     year: int
     month: int
     percentage: float
+
+class StudentDashboard(BaseModel):
+    student: StudentSummary
+    year: int
+    month: int
+    attendance: MonthlyAttendance
+    # None when the student sat no exams in the month
+    exam_percentage: Optional[float] = None
+    dues: Dict[int, float]
+    # Newest first
+    payments: List[PaymentHistory]
+    exams: List[ExamHistory]
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    kind: str
+    total_rows: int = 0
+    inserted: int = 0
+    errors: List[ImportRowError] = []
+    # IDs generated for imported students, in file order
+    created_ids: Optional[List[str]] = None
+
+class StudentExamRanking(BaseModel):
+    student_id: str
+    name: Optional[str] = None
+    kb_batch: Optional[str] = None
+    exams: int
+    percentage: float
+    # 1 is the best; students with equal percentages share a rank
+    rank: int
+    percentile: float
+    # Average percentage of the last `window` exams, and its change from the first `window` exams
+    moving_average: float
+    improvement: float
+
+class SubjectPerformance(BaseModel):
+    subject_name: str
+    exams: int
+    students: int
+    percentage: float
+
+class ExamAnalytics(BaseModel):
+    kb_batch: Optional[str] = None
+    year: Optional[int] = None
+    window: int
+    students: List[StudentExamRanking]
+    subjects: List[SubjectPerformance]
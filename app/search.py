@@ -0,0 +1,187 @@
+"""Full-text and prefix search over students.
+
+On SQLite, students_fts is an FTS5 table holding each student's id, name,
+phone, phone digits (the number with separators stripped, so "0171234" finds
+"01712-345678") and address. Triggers on students keep it in step with every
+insert, update and delete, including bulk imports. Every word of the query is
+matched as a prefix, so results narrow as the user types.
+
+Matches are ranked by where the words hit: id and name above phone, phone above
+address, and a whole word above a prefix. Only the newest CANDIDATES matches
+are ranked; when that many match, so do the newest CANDIDATES matches of the
+words as whole words, so an older student whose name is exactly what was typed
+isn't crowded out by newer ones it is only a prefix of. bm25() would cost time
+in proportion to every row a query word matches, which for a one- or two-letter
+prefix over 200k students is far more than the 5 ms a lookup may take; reading
+the newest matches stops early, and each further letter typed narrows them.
+
+The table keeps its own copy of the columns rather than reading students
+through external content: students has no INTEGER PRIMARY KEY, so its rowids
+may change on VACUUM. Rows are found for deletion by matching the id column
+and comparing it exactly, which uses the full-text index.
+
+Other databases fall back to a case-insensitive substring match ordered by id.
+
+Databases created before the index existed are filled on startup; if students
+are changed with the triggers missing, check and rebuild it with
+
+    python -m app.search check
+    python -m app.search rebuild
+"""
+import re
+import sys
+from sqlalchemy import or_, text
+from sqlalchemy.orm import Session
+from . import models, schemas, database
+
+TABLE = "students_fts"
+COLUMNS = ("id", "name", "phone", "phone_digits", "address")
+# Score for a word hitting each column, in COLUMNS order; a whole word scores double
+WEIGHTS = (10, 8, 4, 4, 1)
+CANDIDATES = 200
+
+def digits(column):
+    # Nested replace() rather than a Python function so the triggers work on any connection
+    for separator in ("-", " ", "+", "(", ")", "."):
+        column = f"replace({column}, '{separator}', '')"
+    return column
+
+def values(row):
+    return f"{row}.id, {row}.name, {row}.phone, {digits(f'{row}.phone')}, {row}.address"
+
+def delete_row(row):
+    return (
+        f"DELETE FROM {TABLE} WHERE rowid IN (SELECT rowid FROM {TABLE} "
+        f"WHERE {TABLE} MATCH 'id : \"' || replace({row}.id, '\"', '\"\"') || '\"' AND id = {row}.id);"
+    )
+
+DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    f"{', '.join(COLUMNS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3 4')",
+    f"CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN "
+    f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) VALUES ({values('new')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN "
+    f"{delete_row('old')} END",
+    f"CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE ON students BEGIN "
+    f"{delete_row('old')} "
+    f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) VALUES ({values('new')}); END",
+)
+
+def enabled():
+    return database.backend.name == "sqlite"
+
+def create_index(engine):
+    """Create the search table and its triggers if they don't exist yet."""
+    if not enabled():
+        return
+    with engine.begin() as conn:
+        for statement in DDL:
+            conn.execute(text(statement))
+
+def drop_index(engine):
+    if not enabled():
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+def rebuild(db: Session):
+    """Refill the search table from students. Commit is left to the caller."""
+    if not enabled():
+        return
+    db.execute(text(f"DELETE FROM {TABLE}"))
+    db.execute(text(f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) SELECT {values('students')} FROM students"))
+
+def check(db: Session):
+    """Compare the search table with students and return a list of mismatch descriptions."""
+    if not enabled():
+        return []
+    expected = {
+        row[0]: tuple(row) for row in db.execute(text(f"SELECT {values('students')} FROM students"))
+    }
+    actual = {}
+    problems = []
+    for row in db.execute(text(f"SELECT {', '.join(COLUMNS)} FROM {TABLE}")):
+        if row[0] in actual:
+            problems.append(f"{row[0]}: indexed more than once")
+        actual[row[0]] = tuple(row)
+    for student_id in sorted(expected.keys() | actual.keys()):
+        if student_id not in actual:
+            problems.append(f"{student_id}: missing from search index")
+        elif student_id not in expected:
+            problems.append(f"{student_id}: in search index but not a student")
+        elif expected[student_id] != actual[student_id]:
+            problems.append(f"{student_id}: search index is out of date")
+    return problems
+
+def match_expression(q: str, prefix=True):
+    """An FTS5 query matching every word of `q` as a prefix (or, with prefix=False,
+    as a whole word), or None if it has no words."""
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    star = "*" if prefix else ""
+    expression = " AND ".join(f'"{word}"{star}' for word in words)
+    number = re.sub(r"\D", "", q)
+    if len(words) > 1 and len(number) >= 3:
+        # "01712 345" should find 01712-345678 as well
+        expression = f'({expression}) OR phone_digits : "{number}"{star}'
+    return expression
+
+def search_students(db: Session, q: str, limit: int):
+    if not enabled():
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = db.query(
+            models.Student.id, models.Student.name, models.Student.hsc_batch,
+            models.Student.kb_batch, models.Student.phone, models.Student.address
+        ).filter(or_(*(
+            column.ilike(pattern, escape="\\")
+            for column in (models.Student.id, models.Student.name, models.Student.phone, models.Student.address)
+        ))).order_by(models.Student.id).limit(limit).all()
+        return [schemas.StudentSummary.from_orm(row) for row in rows]
+
+    if match_expression(q) is None:
+        return []
+    query = text(
+        f"SELECT {', '.join(COLUMNS)} FROM {TABLE} WHERE {TABLE} MATCH :expression "
+        f"ORDER BY rowid DESC LIMIT :candidates"
+    )
+    candidates = db.execute(query, {"expression": match_expression(q), "candidates": CANDIDATES}).all()
+    if len(candidates) == CANDIDATES:
+        # Older whole-word matches may have been cut off; rank them too, ahead of
+        # the prefix matches
+        exact = db.execute(query, {"expression": match_expression(q, prefix=False), "candidates": CANDIDATES}).all()
+        exact_ids = {row[0] for row in exact}
+        candidates = exact + [row for row in candidates if row[0] not in exact_ids]
+    patterns = [re.compile(rf"\b{re.escape(word.lower())}(\w*)") for word in re.findall(r"\w+", q)]
+    # sorted() is stable, so equal scores keep whole-word matches first, newest first
+    ids = [row[0] for row in sorted(candidates, key=lambda row: -score(patterns, row))[:limit]]
+    students = {
+        row.id: row for row in db.query(
+            models.Student.id, models.Student.name, models.Student.hsc_batch,
+            models.Student.kb_batch, models.Student.phone, models.Student.address
+        ).filter(models.Student.id.in_(ids))
+    }
+    return [schemas.StudentSummary.from_orm(students[student_id]) for student_id in ids if student_id in students]
+
+def score(patterns, row):
+    """Sum WEIGHTS over the columns each word hits; `patterns` match a word at the start of a token."""
+    total = 0
+    for value, weight in zip(row, WEIGHTS):
+        if not value:
+            continue
+        value = value.lower()
+        for pattern in patterns:
+            hit = pattern.search(value)
+            if hit is not None:
+                # The group holds the rest of the token: empty for a whole word
+                total += weight if hit.group(1) else 2 * weight
+    return total
+
+def main(argv):
+    if argv in (["check"], ["rebuild"]) and not enabled():
+        print(f"Full-text search needs SQLite; {database.backend.name} uses substring matching")
+        return 0
+    return database.derived_table_main(argv, check, rebuild, "Student search index")
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,38 @@
+"""Student ID generation.
+
+New IDs are `{hsc_batch}-{number}`, numbered from a per-batch counter in the
+student_id_sequences table, e.g. "2025-000042". The counter is advanced with a
+single atomic upsert in the caller's transaction, so IDs never collide and need
+no retry loop, and a batch's students sort together (and are inserted at the
+end of their batch's range) in the primary key index.
+
+IDs in the old random `XXXXXX-{hsc_batch}` format remain valid; students are
+only ever looked up by whatever ID they were given.
+"""
+from sqlalchemy.orm import Session
+from . import models, database
+
+ID_DIGITS = 6
+
+def format_id(hsc_batch, number):
+    return f"{hsc_batch}-{number:0{ID_DIGITS}d}"
+
+def reserve_ids(db: Session, hsc_batch, count=1):
+    """Reserve `count` consecutive IDs for a batch and return them in order.
+
+    The reservation belongs to the session's transaction: it holds the batch's
+    counter until commit, and is undone with everything else on rollback.
+    """
+    if count < 1:
+        return []
+    table = models.StudentIdSequence.__table__
+    stmt = database.backend.insert(table).values(hsc_batch=hsc_batch, last_value=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.hsc_batch],
+        set_={"last_value": table.c.last_value + count},
+    ).returning(table.c.last_value)
+    last = db.execute(stmt).scalar_one()
+    return [format_id(hsc_batch, number) for number in range(last - count + 1, last + 1)]
+
+def next_id(db: Session, hsc_batch):
+    return reserve_ids(db, hsc_batch)[0]
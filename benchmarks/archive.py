@@ -0,0 +1,137 @@
+"""Live database size and query latency before and after archiving past years.
+
+    python -m benchmarks.archive [years] [students]
+
+Seeds a throwaway SQLite database with `years` years (5 by default) of daily
+attendance, monthly payments and weekly exams for `students` students (300 by
+default), then times the reads that cover archived data (a year's payment and
+exam lists, a student's payment and exam history) against the current year and
+the oldest one, archives every year but the last, times them again, and
+restores everything. Reports file sizes, the time each archive and restore
+took and whether the restored tables match the originals.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+def seed(years, students):
+    from app import database, models, ledger, rollups
+    database.migrate()
+    db = database.SessionLocal()
+    ids = [f"2024-{i:06d}" for i in range(students)]
+    database.bulk_insert(db, models.Student, [
+        {"id": student_id, "name": f"Student {student_id}", "hsc_batch": "2024", "kb_batch": f"B{i % 10}"}
+        for i, student_id in enumerate(ids)
+    ])
+    first = date.today().year - years + 1
+    for year in range(first, first + years):
+        days = [date(year, 1, 1) + timedelta(days=n) for n in range(365)]
+        database.bulk_insert(db, models.Attendance, [
+            {"student_id": student_id, "date": day, "present": (n + i) % 7 != 0}
+            for n, day in enumerate(days) for i, student_id in enumerate(ids)
+        ])
+        database.bulk_insert(db, models.PaymentHistory, [
+            {"student_id": student_id, "date": date(year, month, 5), "payment": 2000.0, "paid": 1500.0,
+             "due": 500.0, "total_subjects": 3}
+            for month in range(1, 13) for student_id in ids
+        ])
+        database.bulk_insert(db, models.ExamHistory, [
+            {"student_id": student_id, "date": day, "subject_name": "Physics", "total_marks": 100,
+             "obtained_marks": 40 + (n + i) % 60}
+            for n, day in enumerate(days[::7]) for i, student_id in enumerate(ids)
+        ])
+    ledger.rebuild(db)
+    rollups.rebuild(db)
+    db.commit()
+    db.close()
+    return ids, first
+
+def table_snapshot():
+    from sqlalchemy import select
+    from app import archive, database
+    with database.engine.connect() as conn:
+        return {
+            model.__tablename__: sorted(tuple(row) for row in conn.execute(select(model.__table__)))
+            for model in archive.MODELS
+        }
+
+def timed(fn, repeat=10):
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - began)
+    return statistics.median(times) * 1000
+
+def database_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix)) / 2**20
+
+def main():
+    years = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    students = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["KB_ARCHIVE_DIR"] = os.path.join(workdir, "archive")
+    os.environ["KB_CACHE_BACKEND"] = "none"
+    os.environ.setdefault("KB_SLOW_QUERY_MS", "60000")
+    from sqlalchemy import text
+    from app import archive, crud, database
+
+    ids, first = seed(years, students)
+    last = first + years - 1
+    original = table_snapshot()
+    with database.engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    print(f"seeded {years} years x {students} students: "
+          f"{sum(len(rows) for rows in original.values())} rows, live database {database_size(path):.1f} MiB\n")
+
+    def reads():
+        db = database.SessionLocal()
+        try:
+            return {
+                f"payments/year/{last}": timed(lambda: crud.get_yearly_payments(db, last)),
+                f"payments/year/{first}": timed(lambda: crud.get_yearly_payments(db, first)),
+                f"exams/year/{first}": timed(lambda: crud.get_yearly_exams(db, first)),
+                "payments/student": timed(lambda: crud.get_student_payment_history.__wrapped__(db, ids[0])),
+                "exams/student": timed(lambda: crud.get_student_exam_history.__wrapped__(db, ids[0])),
+            }
+        finally:
+            db.close()
+
+    before = reads()
+    db = database.SessionLocal()
+    try:
+        for year in range(first, last):
+            began = time.perf_counter()
+            counts = archive.archive_year(db, year)
+            print(f"archived {year}: {sum(counts.values())} rows in {time.perf_counter() - began:.2f} s, "
+                  f"{os.path.getsize(archive.archive_path(year)) / 2**20:.1f} MiB")
+    finally:
+        db.close()
+    with database.engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        conn.exec_driver_sql("VACUUM")
+    print(f"live database after archiving: {database_size(path):.1f} MiB\n")
+    after = reads()
+
+    print(f"{'median of 10':<22} {'all live':>10} {'archived':>10}")
+    for name in before:
+        print(f"{name:<22} {before[name]:7.1f} ms {after[name]:7.1f} ms")
+    print()
+
+    db = database.SessionLocal()
+    try:
+        for year in range(first, last):
+            began = time.perf_counter()
+            archive.restore_year(db, year)
+            print(f"restored {year} in {time.perf_counter() - began:.2f} s")
+    finally:
+        db.close()
+    print(f"restored tables match the originals: {table_snapshot() == original}")
+
+if __name__ == "__main__":
+    main()
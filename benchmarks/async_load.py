@@ -0,0 +1,87 @@
+"""Requests/sec at high concurrency for the async and sync database modes.
+
+    python -m benchmarks.async_load [clients] [requests_per_client]
+
+Seeds a throwaway database, then for each KB_DATABASE_MODE starts a fresh
+interpreter that drives the app in-process through httpx's ASGI transport with
+`clients` concurrent clients (200 by default) issuing read requests.
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+STUDENTS = 500
+
+def seed():
+    from app import database, models
+    database.migrate()
+    db = database.SessionLocal()
+    ids = [f"L{i:05d}-2024" for i in range(STUDENTS)]
+    db.bulk_insert_mappings(models.Student, [
+        {"id": student_id, "name": f"Student {i}", "hsc_batch": "2024", "kb_batch": f"B{i % 10}"}
+        for i, student_id in enumerate(ids)
+    ])
+    db.bulk_insert_mappings(models.PaymentHistory, [
+        {"student_id": student_id, "date": date(2024, 1, 5) + timedelta(days=30 * m),
+         "payment": 2000.0, "paid": 1500.0, "due": 500.0, "total_subjects": 3}
+        for student_id in ids for m in range(12)
+    ])
+    db.bulk_insert_mappings(models.Attendance, [
+        {"student_id": student_id, "date": date(2024, 3, 1) + timedelta(days=d), "present": d % 4 != 0}
+        for student_id in ids for d in range(20)
+    ])
+    db.commit()
+    db.close()
+
+async def drive(clients, per_client):
+    import logging
+    import httpx
+    from app.main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    ids = [f"L{i:05d}-2024" for i in range(STUDENTS)]
+    urls = [
+        lambda sid: f"/students/{sid}",
+        lambda sid: f"/payments/student/{sid}",
+        lambda sid: f"/monthly_attendance/{sid}/2024/3",
+        lambda sid: f"/monthly_payment/{sid}/2024/3",
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in range(per_client):
+                response = await client.get(random.choice(urls)(random.choice(ids)))
+                assert response.status_code == 200, response.text
+
+        await worker()  # warm up connections
+        began = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        elapsed = time.perf_counter() - began
+    total = clients * per_client
+    print(f"{os.environ['KB_DATABASE_MODE']:>5}: {total} requests in {elapsed:.2f}s = {total / elapsed:7.1f} req/s")
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    if os.environ.get("KB_BENCH_CHILD"):
+        asyncio.run(drive(clients, per_client))
+        return
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=root, KB_DATABASE_MODE="sync")
+    subprocess.run([sys.executable, "-c", "from benchmarks.async_load import seed; seed()"], cwd=workdir, env=env, check=True)
+    for mode in ("sync", "async"):
+        env = dict(os.environ, PYTHONPATH=root, KB_DATABASE_MODE=mode, KB_BENCH_CHILD="1")
+        subprocess.run([sys.executable, "-m", "benchmarks.async_load", str(clients), str(per_client)],
+                       cwd=workdir, env=env, check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Wall time of one batch report versus one export per student.
+
+    python -m benchmarks.batch_report [students] [payments_per_student]
+
+Seeds a throwaway database with a single kb_batch of `students` students (1,000
+by default) and compares GET /reports/batch/{kb_batch}/excel against calling
+GET /students/{id}/payment_history_excel once for every student.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    per_student = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+
+    tmp = tempfile.mkdtemp()
+    os.chdir(tmp)  # the app keeps kendrobindu.db in the working directory
+
+    from fastapi.testclient import TestClient
+    from app import database, models
+    from app.main import app
+
+    database.migrate()
+    db = database.SessionLocal()
+    ids = [f"S{i:05d}-2024" for i in range(students)]
+    db.bulk_insert_mappings(models.Student, [
+        {"id": student_id, "name": f"Student {i}", "hsc_batch": "2024", "kb_batch": "Bench"}
+        for i, student_id in enumerate(ids)
+    ])
+    db.bulk_insert_mappings(models.PaymentHistory, [
+        {"student_id": student_id, "date": date(2024, 1, 10) + timedelta(days=30 * m),
+         "payment": 2000.0, "paid": 1500.0, "due": 500.0, "total_subjects": 3}
+        for student_id in ids for m in range(per_student)
+    ])
+    db.commit()
+    db.close()
+
+    with TestClient(app) as client:
+        began = time.perf_counter()
+        response = client.get("/reports/batch/Bench/excel")
+        batch_time = time.perf_counter() - began
+        assert response.status_code == 200, response.text
+        print(f"batch report:        {batch_time:7.2f}s  ({len(response.content) / 1024:.0f} KiB, one workbook)")
+
+        began = time.perf_counter()
+        size = 0
+        for student_id in ids:
+            response = client.get(f"/students/{student_id}/payment_history_excel")
+            assert response.status_code == 200, response.text
+            size += len(response.content)
+        loop_time = time.perf_counter() - began
+        print(f"per-student exports: {loop_time:7.2f}s  ({size / 1024:.0f} KiB, {students} workbooks)")
+        print(f"speedup: {loop_time / batch_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
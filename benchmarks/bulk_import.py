@@ -0,0 +1,52 @@
+"""Rows/sec for the bulk import endpoint against one POST per record.
+
+    python -m benchmarks.bulk_import [rows] [per_row_sample]
+
+Seeds a throwaway database, builds a payments CSV of `rows` rows (100,000 by
+default) and uploads it to POST /import/payments, then times `per_row_sample`
+(1,000 by default) individual POST /payments/ calls for comparison.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.async_load import STUDENTS, seed
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sample = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+
+    os.chdir(tempfile.mkdtemp())
+    seed()
+
+    import logging
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    client = TestClient(app)
+    ids = [f"L{i:05d}-2024" for i in range(STUDENTS)]
+    days = [(date(2025, 1, 1) + timedelta(days=d)).isoformat() for d in range(365)]
+
+    lines = ["student_id,date,payment,paid,total_subjects"]
+    lines.extend(f"{ids[i % STUDENTS]},{days[i % 365]},2000,1500,3" for i in range(rows))
+    body = "\n".join(lines).encode()
+
+    began = time.perf_counter()
+    response = client.post("/import/payments", files={"file": ("payments.csv", body)})
+    elapsed = time.perf_counter() - began
+    assert response.status_code == 200 and response.json()["inserted"] == rows, response.text
+    print(f"import    {rows:>7} rows {elapsed:8.2f} s  {rows / elapsed:10.0f} rows/s")
+
+    began = time.perf_counter()
+    for i in range(sample):
+        response = client.post("/payments/", json={"student_id": ids[i % STUDENTS], "date": days[i % 365],
+                                                   "payment": 2000, "paid": 1500, "total_subjects": 3})
+        assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - began
+    print(f"per-row   {sample:>7} rows {elapsed:8.2f} s  {sample / elapsed:10.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
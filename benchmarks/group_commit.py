@@ -0,0 +1,98 @@
+"""Throughput and latency of concurrent single-row writes, with and without group commit.
+
+    python -m benchmarks.group_commit [clients] [requests_per_client]
+
+Seeds a throwaway database with students, then for each write path starts a
+fresh interpreter that drives the app in-process through httpx's ASGI
+transport: `clients` concurrent clients (100 by default) each post attendance
+marks for their own students, as a morning of check-ins would. Reports
+requests/sec, median and p99 latency, the mean number of writes per commit,
+and checks every mark was stored.
+
+  per-request   KB_GROUP_COMMIT=0: each request commits on its own
+  group commit  KB_GROUP_COMMIT=1: the writer task commits queued marks together
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+STUDENTS = 2000
+
+def seed():
+    from app import database, models
+    database.migrate()
+    db = database.SessionLocal()
+    database.bulk_insert(db, models.Student, [
+        {"id": f"2024-{i:06d}", "name": f"Student {i}", "hsc_batch": "2024", "kb_batch": f"B{i % 20}"}
+        for i in range(STUDENTS)
+    ])
+    db.commit()
+    db.close()
+
+async def drive(clients, per_client, first_day):
+    import logging
+    import httpx
+    from app.main import app
+    from app import database, models, group_commit
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    latencies = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def worker(n, days):
+                for i in range(per_client):
+                    mark = {
+                        "student_id": f"2024-{(n * per_client + i) % STUDENTS:06d}",
+                        "date": str(days + timedelta(days=(n * per_client + i) // STUDENTS)),
+                        "present": i % 5 != 0,
+                    }
+                    began = time.perf_counter()
+                    response = await client.post("/attendance/", json=mark)
+                    latencies.append(time.perf_counter() - began)
+                    assert response.status_code == 200, response.text
+
+            await worker(0, first_day - timedelta(days=30))  # warm up
+            latencies.clear()
+            began = time.perf_counter()
+            await asyncio.gather(*(worker(n, first_day) for n in range(clients)))
+            elapsed = time.perf_counter() - began
+        writer = group_commit.writer
+        per_commit = writer.writes / writer.batches if writer is not None else 1.0
+
+    db = database.SessionLocal()
+    stored = db.query(models.Attendance).filter(models.Attendance.date >= first_day).count()
+    db.close()
+    total = clients * per_client
+    latencies.sort()
+    label = "group commit" if os.environ["KB_GROUP_COMMIT"] == "1" else "per-request"
+    print(
+        f"{label:>12}: {total / elapsed:7.1f} req/s  median {statistics.median(latencies) * 1000:6.1f} ms  "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms  {per_commit:5.1f} writes/commit  stored {stored}/{total}"
+    )
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    if os.environ.get("KB_BENCH_CHILD"):
+        asyncio.run(drive(clients, per_client, date.fromisoformat(os.environ["KB_BENCH_DAY"])))
+        return
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=root, KB_CACHE_BACKEND="none", KB_SLOW_QUERY_MS="60000")
+    subprocess.run([sys.executable, "-c", "from benchmarks.group_commit import seed; seed()"], cwd=workdir, env=env, check=True)
+    # Each run marks its own range of days, so both start from the same table size
+    for enabled, day in (("0", "2025-01-01"), ("1", "2025-07-01")):
+        child = dict(env, KB_GROUP_COMMIT=enabled, KB_BENCH_CHILD="1", KB_BENCH_DAY=day)
+        subprocess.run([sys.executable, "-m", "benchmarks.group_commit", str(clients), str(per_client)],
+                       cwd=workdir, env=child, check=True)
+
+if __name__ == "__main__":
+    main()
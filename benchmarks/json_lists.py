@@ -0,0 +1,91 @@
+"""Latency and peak RSS of GET /payments/year/{year} on a large year.
+
+    python -m benchmarks.json_lists [rows]
+
+Seeds a throwaway database with `rows` payments (500,000 by default) in one
+year, then for each response path starts a fresh interpreter, fetches the whole
+year once and reports the time and the process's peak RSS growth. The test
+client buffers the response body in the same process, so every figure includes
+roughly the body size on the client side:
+
+  pydantic  the previous path: a PaymentHistory model per ORM row, serialized
+            through the response_model (registered here as a comparison route)
+  orjson    the current default: column tuples serialized with orjson
+  ndjson    ?stream=1: rows streamed as NDJSON while they are fetched
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+MODES = ("pydantic", "orjson", "ndjson")
+
+def seed(rows):
+    from app import database, models
+    database.migrate()
+    db = database.SessionLocal()
+    students = [f"J{i:05d}-2024" for i in range(1000)]
+    db.bulk_insert_mappings(models.Student, [
+        {"id": student_id, "name": f"Student {student_id}", "hsc_batch": "2024"} for student_id in students
+    ])
+    for start in range(0, rows, 50_000):
+        database.bulk_insert(db, models.PaymentHistory, [
+            {"student_id": students[i % len(students)], "date": date(2024, 1, 1) + timedelta(days=i % 365),
+             "payment": 2000.0, "paid": 1500.0, "due": 500.0, "total_subjects": 3}
+            for i in range(start, min(rows, start + 50_000))
+        ])
+    db.commit()
+    db.close()
+
+def measure(mode):
+    import logging
+    from typing import List
+    from fastapi import Depends
+    from fastapi.testclient import TestClient
+    from sqlalchemy.orm import Session
+    from app import database, models, schemas
+    from app.main import app
+
+    @app.get("/bench/pydantic/{year}", response_model=List[schemas.PaymentHistory])
+    def pydantic_payments(year: int, db: Session = Depends(database.get_sync_db)):
+        payments = db.query(models.PaymentHistory).filter(
+            models.PaymentHistory.date >= date(year, 1, 1), models.PaymentHistory.date < date(year + 1, 1, 1)
+        ).all()
+        return [schemas.PaymentHistory.from_orm(payment) for payment in payments]
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    url = {"pydantic": "/bench/pydantic/2024", "orjson": "/payments/year/2024", "ndjson": "/payments/year/2024?stream=1"}[mode]
+    headers = {"Accept-Encoding": "identity"}
+    with TestClient(app) as client:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        began = time.perf_counter()
+        size = 0
+        with client.stream("GET", url, headers=headers) as response:
+            assert response.status_code == 200, response.read()
+            for chunk in response.iter_bytes():
+                size += len(chunk)
+        elapsed = time.perf_counter() - began
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{mode:<9} {elapsed:7.2f} s  {size / 1e6:7.1f} MB body  peak RSS +{(peak - baseline) / 1024:7.1f} MiB")
+
+def main():
+    if os.environ.get("KB_BENCH_MODE"):
+        measure(os.environ["KB_BENCH_MODE"])
+        return
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=root, KB_CACHE_BACKEND="none")
+    subprocess.run([sys.executable, "-c", f"from benchmarks.json_lists import seed; seed({rows})"],
+                   cwd=workdir, env=env, check=True)
+    print(f"{rows} payment rows")
+    for mode in MODES:
+        subprocess.run([sys.executable, "-m", "benchmarks.json_lists"],
+                       cwd=workdir, env=dict(env, KB_BENCH_MODE=mode), check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare extract()-based and range-based period filters on payment_history.
+
+    python -m benchmarks.period_filters [rows]
+
+Builds a throwaway SQLite database with `rows` payment records (1M by default)
+spread over ten years, then prints the query plan and timing of the old
+extract('year'/'month') filters next to the in_period() range filters.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, extract, insert, select
+
+from app import models
+from app.periods import in_period
+
+def build(engine, rows):
+    models.Base.metadata.create_all(bind=engine)
+    start = date(2015, 1, 1)
+    batch = []
+    with engine.begin() as conn:
+        for i in range(rows):
+            payment = random.choice([1500.0, 2000.0, 2500.0])
+            paid = random.choice([payment, payment / 2, 0.0])
+            batch.append({
+                "student_id": f"S{i % 20000:05d}-2018",
+                "date": start + timedelta(days=random.randrange(3650)),
+                "payment": payment,
+                "paid": paid,
+                "due": payment - paid,
+                "total_subjects": 3,
+            })
+            if len(batch) == 50000:
+                conn.execute(insert(models.PaymentHistory), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.PaymentHistory), batch)
+
+def measure(conn, label, stmt, repeat=5):
+    compiled = stmt.compile(conn, compile_kwargs={"literal_binds": True})
+    plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").fetchall()
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        count = len(conn.execute(stmt).all())
+        best = min(best, time.perf_counter() - began)
+    print(f"{label:<28} {count:>7} rows  {best * 1000:8.1f} ms  plan: {'; '.join(row[-1] for row in plan)}")
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        began = time.perf_counter()
+        build(engine, rows)
+        print(f"built {rows} payment rows in {time.perf_counter() - began:.1f}s\n")
+
+        date_col = models.PaymentHistory.date
+        columns = select(models.PaymentHistory.id, models.PaymentHistory.due)
+        with engine.connect() as conn:
+            measure(conn, "year, extract()", columns.where(extract("year", date_col) == 2020))
+            measure(conn, "year, range", columns.where(in_period(date_col, 2020)))
+            measure(conn, "month, extract()", columns.where(
+                extract("year", date_col) == 2020, extract("month", date_col) == 12))
+            measure(conn, "month, range", columns.where(in_period(date_col, 2020, 12)))
+            student = models.PaymentHistory.student_id == "S00042-2018"
+            measure(conn, "student month, extract()", columns.where(
+                student, extract("year", date_col) == 2020, extract("month", date_col) == 12))
+            measure(conn, "student month, range", columns.where(student, in_period(date_col, 2020, 12)))
+        engine.dispose()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Assert that student endpoints issue a fixed number of SQL statements.
+
+    python -m benchmarks.query_counts
+
+Runs every checked endpoint against a small and a large kb_batch (with a few
+payments and exams per student) and fails if the number of statements
+executed differs between the two, i.e. if anything is loaded per row.
+tests/test_query_counts.py runs the same check under pytest.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import event
+
+SMALL, LARGE = 3, 300
+
+PAYLOAD = {"name": "Checked", "hsc_batch": "2024", "kb_batch": "Small"}
+# (method, url template, JSON body); {batch} is Small or Large, {student} its first student
+ENDPOINTS = [
+    ("GET", "/students/?kb_batch={batch}&limit=1000", None),
+    ("GET", "/students/batch/{batch}", None),
+    ("GET", "/students/batch/{batch}?include=payments,exams", None),
+    ("GET", "/students/{student}", None),
+    ("GET", "/students/{student}?include=payments,exams", None),
+    ("GET", "/students/{student}/dashboard?year=2024&month=2&limit=5", None),
+    ("PUT", "/students/{student}?include=payments,exams", PAYLOAD),
+    ("POST", "/students/?include=payments,exams", PAYLOAD),
+    ("GET", "/monthly_attendance/batch/{batch}/2024/1", None),
+    ("GET", "/attendance/batch/{batch}/2024", None),
+    ("GET", "/attendance/trend/batch/{batch}?from_year=2023&to_year=2024", None),
+]
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+def seed(db, models, kb_batch, size):
+    ids = [f"{kb_batch}{i:04d}-2024" for i in range(size)]
+    db.bulk_insert_mappings(models.Student, [
+        {"id": student_id, "name": f"Student {student_id}", "hsc_batch": "2024", "kb_batch": kb_batch}
+        for student_id in ids
+    ])
+    db.bulk_insert_mappings(models.PaymentHistory, [
+        {"student_id": student_id, "date": date(2024, month, 10), "payment": 2000.0,
+         "paid": 2000.0, "due": 0.0, "total_subjects": 3}
+        for student_id in ids for month in (1, 2)
+    ])
+    db.bulk_insert_mappings(models.ExamHistory, [
+        {"student_id": student_id, "date": date(2024, month, 20), "subject_name": "Physics",
+         "total_marks": 100.0, "obtained_marks": 70.0}
+        for student_id in ids for month in (1, 2)
+    ])
+    db.bulk_insert_mappings(models.Attendance, [
+        {"student_id": student_id, "date": date(2024, month, day), "present": day % 3 != 0}
+        for student_id in ids for month in (1, 2) for day in (5, 6, 7)
+    ])
+    db.commit()
+    return ids
+
+def seed_batches():
+    """Seed the Small and Large batches with their ledger and rollups; returns their student ids."""
+    from app import database, models, ledger, rollups
+    database.migrate()
+    db = database.SessionLocal()
+    try:
+        batches = {"Small": seed(db, models, "Small", SMALL), "Large": seed(db, models, "Large", LARGE)}
+        ledger.rebuild(db)
+        rollups.rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+    return batches
+
+def statement_counts(client, engine, method, template, body, batches):
+    """The number of statements the request issues for each batch, in batches' order."""
+    counts = []
+    for batch, ids in batches.items():
+        url = template.format(batch=batch, student=ids[0])
+        with count_queries(engine) as statements:
+            response = client.request(method, url, json=body)
+        assert response.status_code == 200, (url, response.text)
+        counts.append(len(statements))
+    return counts
+
+def main():
+    os.chdir(tempfile.mkdtemp())  # the app keeps kendrobindu.db in the working directory
+
+    from fastapi.testclient import TestClient
+    from app import database
+    from app.main import app
+
+    batches = seed_batches()
+
+    # In async mode requests go through the async engine's underlying sync engine
+    engine = database.async_engine.sync_engine if database.async_engine is not None else database.engine
+
+    failures = 0
+    with TestClient(app) as client:
+        for method, template, body in ENDPOINTS:
+            counts = statement_counts(client, engine, method, template, body, batches)
+            ok = counts[0] == counts[1]
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {method:<4} {template:<52} {SMALL}: {counts[0]:>3}  {LARGE}: {counts[1]:>3}")
+
+    if failures:
+        raise SystemExit(f"{failures} endpoint(s) issue per-row queries")
+
+if __name__ == "__main__":
+    main()
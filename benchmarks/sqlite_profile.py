@@ -0,0 +1,83 @@
+"""Mixed read/write latency with and without the SQLite performance profile.
+
+    python -m benchmarks.sqlite_profile [clients] [requests_per_client] [write_percent]
+
+For KB_SQLITE_PROFILE=default (rollback journal, stock pragmas) and
+KB_SQLITE_PROFILE=performance, seeds a fresh database and runs `clients`
+concurrent clients (50 by default) against the app through httpx's ASGI
+transport. A `write_percent` share of requests (20% by default) record
+attendance or payments; the rest read summaries. Prints p50/p99 latency.
+"""
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.async_load import STUDENTS
+
+async def drive(clients, per_client, write_percent):
+    import logging
+    import httpx
+    from app.main import app
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    ids = [f"L{i:05d}-2024" for i in range(STUDENTS)]
+    latencies = {"read": [], "write": []}
+
+    def request():
+        student_id = random.choice(ids)
+        if random.randrange(100) < write_percent:
+            day = f"2024-05-{random.randint(1, 28):02d}"
+            if random.random() < 0.5:
+                return "write", "POST", "/attendance/", {"student_id": student_id, "date": day, "present": True}
+            return "write", "POST", "/payments/", {"student_id": student_id, "date": day, "payment": 2000,
+                                                   "paid": 2000, "total_subjects": 3}
+        return "read", "GET", random.choice([
+            f"/monthly_attendance/{student_id}/2024/3",
+            f"/payments/student/{student_id}",
+            f"/monthly_payment/{student_id}/2024/3",
+        ]), None
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def worker():
+            for _ in range(per_client):
+                kind, method, url, body = request()
+                began = time.perf_counter()
+                response = await client.request(method, url, json=body)
+                latencies[kind].append(time.perf_counter() - began)
+                assert response.status_code == 200, response.text
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+
+    profile = os.environ["KB_SQLITE_PROFILE"]
+    for kind, values in latencies.items():
+        values.sort()
+        p50 = values[len(values) // 2] * 1000
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1000
+        print(f"{profile:>11} {kind:<5} n={len(values):<5} p50 {p50:8.1f} ms   p99 {p99:8.1f} ms")
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    write_percent = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    if os.environ.get("KB_BENCH_CHILD"):
+        asyncio.run(drive(clients, per_client, write_percent))
+        return
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for profile in ("default", "performance"):
+        # journal_mode=WAL is persistent, so each profile gets its own database
+        workdir = tempfile.mkdtemp()
+        env = dict(os.environ, PYTHONPATH=root, KB_SQLITE_PROFILE=profile)
+        subprocess.run([sys.executable, "-c", "from benchmarks.async_load import seed; seed()"],
+                       cwd=workdir, env=env, check=True)
+        subprocess.run([sys.executable, "-m", "benchmarks.sqlite_profile", str(clients), str(per_client), str(write_percent)],
+                       cwd=workdir, env=dict(env, KB_BENCH_CHILD="1"), check=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Cold start time: from a fresh interpreter to the first response.
+
+    python -m benchmarks.startup [runs] [workers]
+
+Each run starts a new interpreter, so every import is paid again as it would
+be by a new worker. Two measurements, each the median of `runs`:
+
+  in-process  time to import app.main, then to run the startup (lifespan) and
+              serve GET /students/?limit=1, against a new database (which is
+              migrated) and an existing one (which only has its schema stamp
+              read); also lists which heavy modules the import pulled in
+  uvicorn     wall time from launching `uvicorn app.main:app --workers N`
+              against the existing database to its first 200, as a load
+              balancer or autoscaler would see it
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ("openpyxl", "numpy", "app.excel", "app.analytics")
+
+def measure():
+    """Run in a fresh interpreter: print the phase timings as JSON."""
+    began = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    from fastapi.testclient import TestClient
+    client_ready = time.perf_counter()
+    with TestClient(app) as client:
+        response = client.get("/students/?limit=1")
+        assert response.status_code == 200, response.text
+        responded = time.perf_counter()
+    print(json.dumps({
+        "import": imported - began,
+        # The test client's own import isn't part of a real worker's startup
+        "first_response": responded - client_ready,
+        "heavy_modules": loaded,
+    }))
+
+def in_process(workdir, env):
+    output = subprocess.run([sys.executable, "-c", "from benchmarks.startup import measure; measure()"],
+                            cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def uvicorn_cold_start(workdir, env, workers):
+    import httpx
+    port = free_port()
+    began = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env
+    )
+    try:
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/students/?limit=1").status_code == 200:
+                    break
+            except httpx.TransportError:
+                time.sleep(0.01)
+            if time.perf_counter() - began > 60:
+                raise RuntimeError("server did not start within 60 s")
+        return time.perf_counter() - began
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root, KB_CACHE_BACKEND="none")
+
+    new_db, existing_db = [], []
+    for _ in range(runs):
+        new_db.append(in_process(tempfile.mkdtemp(), env))
+    workdir = tempfile.mkdtemp()
+    in_process(workdir, env)  # create and stamp the database once
+    for _ in range(runs):
+        existing_db.append(in_process(workdir, env))
+
+    def median(samples, key):
+        return statistics.median(sample[key] for sample in samples) * 1000
+
+    print(f"median of {runs} fresh interpreters")
+    print(f"import app.main                    {median(existing_db, 'import'):7.0f} ms")
+    print(f"startup + first response, new db   {median(new_db, 'first_response'):7.0f} ms")
+    print(f"startup + first response, existing {median(existing_db, 'first_response'):7.0f} ms")
+    print(f"heavy modules loaded by the import: {', '.join(existing_db[0]['heavy_modules']) or 'none'}")
+
+    cold = [uvicorn_cold_start(workdir, env, workers) for _ in range(runs)]
+    print(f"uvicorn --workers {workers} launch to first response {statistics.median(cold) * 1000:7.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Latency of /students/search lookups against a large student table.
+
+    python -m benchmarks.student_search [students]
+
+Seeds a throwaway SQLite database with `students` students (200,000 by
+default) through the normal insert path, so the search index is filled by its
+triggers, then times search.search_students for type-ahead style queries
+(median and worst of 20 runs) next to the substring LIKE scan a client-side
+or unindexed filter amounts to.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+FIRST = ["Rahim", "Karim", "Nusrat", "Farhana", "Tanvir", "Sadia", "Arif", "Mim", "Rafi", "Jannat",
+         "Hasan", "Ayesha", "Imran", "Sumaiya", "Shakil", "Tasnim", "Mahmud", "Riya", "Sabbir", "Lamia"]
+LAST = ["Ahmed", "Hossain", "Islam", "Rahman", "Chowdhury", "Khan", "Akter", "Uddin", "Sarker", "Das"]
+AREAS = ["Dhanmondi", "Mirpur", "Uttara", "Gulshan", "Mohammadpur", "Banani", "Motijheel", "Badda"]
+QUERIES = ["r", "ra", "rah", "rahim", "rahim ahm", "sad isl", "0171", "01712-34", "017123456", "mirpur 12", "2024-0001", "zzz"]
+
+def seed(students):
+    from app import database, models
+    database.migrate()
+    rng = random.Random(0)
+    db = database.SessionLocal()
+    for start in range(0, students, 50_000):
+        database.bulk_insert(db, models.Student, [
+            {
+                "id": f"{2020 + i % 5}-{i:06d}",
+                "name": f"{rng.choice(FIRST)} {rng.choice(LAST)}",
+                "hsc_batch": str(2020 + i % 5),
+                "kb_batch": f"B{i % 40}",
+                "phone": f"01{rng.randrange(3, 10)}{rng.randrange(10):d}{rng.randrange(10)}-{rng.randrange(10**6):06d}",
+                "address": f"House {rng.randrange(1, 200)}, Road {rng.randrange(1, 30)}, {rng.choice(AREAS)}",
+            }
+            for i in range(start, min(students, start + 50_000))
+        ])
+    db.commit()
+    db.close()
+
+def timed(fn, repeat=20):
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - began)
+    return result, statistics.median(times) * 1000, max(times) * 1000
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("KB_SLOW_QUERY_MS", "60000")
+    from sqlalchemy import or_
+    from app import database, models, search
+
+    began = time.perf_counter()
+    seed(students)
+    print(f"seeded {students} students (indexed by triggers) in {time.perf_counter() - began:.1f} s\n")
+
+    db = database.SessionLocal()
+    try:
+        print(f"{'query':<14} {'rows':>4}  {'fts median':>10}  {'fts worst':>9}  {'LIKE scan':>9}")
+        for q in QUERIES:
+            rows, median, worst = timed(lambda: search.search_students(db, q, 20))
+            pattern = f"%{q}%"
+            _, scan, _ = timed(lambda: db.query(models.Student.id).filter(or_(
+                models.Student.name.like(pattern), models.Student.phone.like(pattern),
+                models.Student.address.like(pattern), models.Student.id.like(pattern)
+            )).limit(20).all(), repeat=3)
+            print(f"{q!r:<14} {len(rows):>4}  {median:8.2f} ms  {worst:6.2f} ms  {scan:6.1f} ms")
+        problems = search.check(db)
+        print(f"\nsearch.check: {len(problems)} mismatches")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
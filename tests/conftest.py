@@ -0,0 +1,50 @@
+"""Each test runs against a database of its own.
+
+`database_url` is a fresh SQLite file under tmp_path. Tests taking
+`any_database_url` run against it and again, marked `postgres`, against the
+PostgreSQL database DATABASE_URL points at, reset first; that run is skipped
+unless DATABASE_URL is a postgresql:// URL. Either way the archive directory
+moves under tmp_path and the student cache starts empty.
+"""
+import os
+import pytest
+from app import archive, backends, cache, database
+
+POSTGRES_URL = os.getenv("DATABASE_URL", "")
+if not POSTGRES_URL.startswith("postgresql://"):
+    POSTGRES_URL = None
+
+def use_database(monkeypatch, tmp_path, url):
+    monkeypatch.setattr(database, "SQLALCHEMY_DATABASE_URL", url)
+    monkeypatch.setattr(database, "backend", backends.get_backend(url))
+    monkeypatch.setattr(database, "_engines", None)
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    cache.clear()
+    database.migrate()
+    if database.backend.name != "sqlite":
+        database.reset_database()
+
+@pytest.fixture
+def database_url(monkeypatch, tmp_path):
+    url = f"sqlite:///{tmp_path / 'kendrobindu.db'}"
+    use_database(monkeypatch, tmp_path, url)
+    yield url
+    database.engines()["engine"].dispose()
+
+@pytest.fixture(params=["sqlite", pytest.param("postgresql", marks=pytest.mark.postgres)])
+def any_database_url(request, monkeypatch, tmp_path):
+    if request.param == "sqlite":
+        url = f"sqlite:///{tmp_path / 'kendrobindu.db'}"
+    elif POSTGRES_URL is None:
+        pytest.skip("DATABASE_URL isn't a postgresql:// URL")
+    else:
+        url = POSTGRES_URL
+    use_database(monkeypatch, tmp_path, url)
+    yield url
+    database.engines()["engine"].dispose()
+
+@pytest.fixture
+def db(database_url):
+    session = database.SessionLocal()
+    yield session
+    session.close()
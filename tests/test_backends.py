@@ -0,0 +1,85 @@
+"""The backend operations the app relies on: reset, bulk_insert and the
+roll-call upsert, on SQLite and (marked postgres) on PostgreSQL."""
+from datetime import date
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from app import database, models, ledger, rollups
+from app.main import app
+
+def student(student_id, **values):
+    return {"id": student_id, "name": f"Student {student_id}", "hsc_batch": "2024", "kb_batch": "B1", **values}
+
+def count(db, model):
+    return db.scalar(select(func.count()).select_from(model))
+
+def test_bulk_insert_writes_every_row_and_value(any_database_url):
+    with database.SessionLocal() as db:
+        database.bulk_insert(db, models.Student, [student("2024-000001", phone="01712-345678"), student("2024-000002", phone=None)])
+        database.bulk_insert(db, models.PaymentHistory, [
+            {"student_id": "2024-000001", "date": date(2024, 1, 5), "payment": 2000.0, "paid": 1500.5,
+             "due": 499.5, "total_subjects": 3},
+            {"student_id": "2024-000002", "date": date(2024, 2, 5), "payment": 1000.0, "paid": 1000.0,
+             "due": 0.0, "total_subjects": 1},
+        ])
+        database.bulk_insert(db, models.ExamHistory, [])
+        db.commit()
+
+        phones = dict(db.execute(select(models.Student.id, models.Student.phone)).all())
+        assert phones == {"2024-000001": "01712-345678", "2024-000002": None}
+        payment = db.query(models.PaymentHistory).filter(models.PaymentHistory.student_id == "2024-000001").one()
+        assert (payment.date, payment.paid, payment.due) == (date(2024, 1, 5), 1500.5, 499.5)
+        assert count(db, models.ExamHistory) == 0
+
+def test_bulk_insert_is_part_of_the_transaction(any_database_url):
+    with database.SessionLocal() as db:
+        database.bulk_insert(db, models.Student, [student("2024-000001")])
+        db.rollback()
+        assert count(db, models.Student) == 0
+
+def test_reset_empties_every_table_and_keeps_the_schema(any_database_url):
+    with database.SessionLocal() as db:
+        database.bulk_insert(db, models.Student, [student("2024-000001")])
+        database.bulk_insert(db, models.Attendance, [{"student_id": "2024-000001", "date": date(2024, 1, 5), "present": True}])
+        rollups.rebuild(db)
+        db.commit()
+
+    database.reset_database()
+
+    with database.SessionLocal() as db:
+        for table in models.Base.metadata.sorted_tables:
+            assert db.scalar(select(func.count()).select_from(table)) == 0, table.name
+        # Ids start over, and the tables take rows again
+        db.add(models.Attendance(student_id=None, date=date(2024, 1, 6), present=False))
+        db.commit()
+        assert db.scalar(select(models.Attendance.id)) == 1
+
+def test_roll_call_creates_then_updates_one_mark_per_student_and_day(any_database_url):
+    with database.SessionLocal() as db:
+        database.bulk_insert(db, models.Student, [student("2024-000001"), student("2024-000002")])
+        db.commit()
+
+    with TestClient(app) as client:
+        roll_call = {"date": "2024-03-04", "records": [
+            {"student_id": "2024-000001", "present": True},
+            {"student_id": "2024-000002", "present": False},
+            {"student_id": "2024-999999", "present": True},
+        ]}
+        response = client.post("/attendance/bulk", json=roll_call)
+        assert response.status_code == 200, response.text
+        assert [result["status"] for result in response.json()] == ["created", "created", "not_found"]
+
+        roll_call["records"] = [
+            {"student_id": "2024-000002", "present": True},
+            {"student_id": "2024-000001", "present": True},
+        ]
+        response = client.post("/attendance/bulk", json=roll_call)
+        assert response.status_code == 200, response.text
+        results = response.json()
+        assert [result["status"] for result in results] == ["updated", "updated"]
+        assert all(result["attendance"]["present"] for result in results)
+
+    with database.SessionLocal() as db:
+        marks = db.execute(select(models.Attendance.student_id, models.Attendance.present)).all()
+        assert sorted(marks) == [("2024-000001", True), ("2024-000002", True)]
+        assert rollups.check(db) == []
+        assert ledger.check(db) == []
@@ -0,0 +1,45 @@
+"""dues_ledger stays in step with the payment history when one payment is deleted twice at once."""
+import threading
+from datetime import date
+from fastapi import HTTPException
+from sqlalchemy import event
+from app import crud, database, ledger, models, schemas
+
+def test_concurrent_deletes_of_one_payment_take_it_off_the_ledger_once(db):
+    student_id = crud.create_student(db, schemas.StudentCreate(name="Student", hsc_batch="2024"), set()).id
+    for month in (1, 2):
+        crud.create_payment(db, schemas.PaymentHistoryCreate(
+            student_id=student_id, date=date(2024, month, 5), payment=2000.0, paid=1500.0, total_subjects=3
+        ))
+
+    # Both requests read the payment before either deletes it, as a retried or
+    # double-clicked delete would
+    both_read = threading.Barrier(2, timeout=10)
+    outcomes = []
+
+    def wait_after_reading_the_payment(state):
+        if state.is_select and state.bind_mapper is not None and state.bind_mapper.class_ is models.PaymentHistory:
+            rows = state.invoke_statement().freeze()
+            both_read.wait()
+            return rows()
+
+    def delete():
+        session = database.SessionLocal()
+        event.listen(session, "do_orm_execute", wait_after_reading_the_payment)
+        try:
+            outcomes.append(crud.delete_payment(session, student_id, date(2024, 1, 5)))
+        except HTTPException as e:
+            outcomes.append(e.status_code)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=delete) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes, key=str) == [404, {"message": "Payment record deleted successfully"}]
+    db.expire_all()
+    assert ledger.check(db) == []
+    assert db.query(models.DuesLedger.total_due).filter(models.DuesLedger.student_id == student_id).scalar() == 500.0
@@ -0,0 +1,15 @@
+"""Student endpoints issue the same number of SQL statements for a batch of
+3 students as for a batch of 300, i.e. nothing is loaded per row."""
+import pytest
+from fastapi.testclient import TestClient
+from app import database
+from app.main import app
+from benchmarks.query_counts import ENDPOINTS, seed_batches, statement_counts
+
+@pytest.mark.parametrize("method, template, body", ENDPOINTS, ids=[f"{method} {template}" for method, template, _ in ENDPOINTS])
+def test_statement_count_doesnt_grow_with_the_batch(database_url, method, template, body):
+    batches = seed_batches()
+    engine = database.async_engine.sync_engine if database.async_engine is not None else database.engine
+    with TestClient(app) as client:
+        small, large = statement_counts(client, engine, method, template, body, batches)
+    assert small == large
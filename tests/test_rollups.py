@@ -0,0 +1,51 @@
+"""attendance_monthly stays in step with attendances under concurrent writes."""
+import threading
+from datetime import date, timedelta
+from fastapi import HTTPException
+from app import crud, database, rollups, schemas
+
+def run(fn, *args):
+    db = database.SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+def test_rollups_match_after_concurrent_marks_roll_calls_and_deletes(db):
+    ids = [crud.create_student(db, schemas.StudentCreate(name=f"Student {i}", hsc_batch="2024"), set()).id for i in range(10)]
+    errors = []
+
+    def write(fn, *args):
+        try:
+            run(fn, *args)
+        except HTTPException:
+            pass  # a delete may find the mark already gone
+        except Exception as e:
+            errors.append(e)
+
+    first = date(2024, 3, 1)
+    for offset in range(5):
+        day, roll_call_day = first + timedelta(days=offset), first + timedelta(days=20 + offset)
+        for student_id in ids:
+            run(crud.create_attendance, schemas.AttendanceCreate(student_id=student_id, date=day, present=False))
+        # Each write below races with others over the same student and day
+        writes = [
+            (crud.create_attendance, schemas.AttendanceCreate(student_id=student_id, date=day, present=True))
+            for student_id in ids for _ in range(3)
+        ]
+        writes.append((crud.create_bulk_attendance, schemas.BulkAttendanceCreate(
+            date=roll_call_day, records=[{"student_id": student_id, "present": True} for student_id in ids]
+        )))
+        writes += [
+            (crud.create_attendance, schemas.AttendanceCreate(student_id=student_id, date=roll_call_day, present=False))
+            for student_id in ids
+        ]
+        writes += [(crud.delete_attendance, student_id, day) for student_id in ids[:3]]
+        threads = [threading.Thread(target=write, args=write_args) for write_args in writes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert run(rollups.check) == []